@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  benchmarks/bruteforce_generator.py
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions are
+#  met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following disclaimer
+#    in the documentation and/or other materials provided with the
+#    distribution.
+#  * Neither the name of the project nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#  A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#  THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#  (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from smoke_zephyr import utilities
+
+def benchmark(name, generator, consume):
+	start = time.perf_counter()
+	count = consume(generator)
+	elapsed = time.perf_counter() - start
+	print("{0:<12} {1:>12,} candidates in {2:6.3f}s ({3:>14,.0f} candidates/s)".format(name, count, elapsed, count / elapsed))
+
+def consume_iterator(generator):
+	count = 0
+	for _ in generator:
+		count += 1
+	return count
+
+def consume_next_into(generator):
+	buffer = bytearray(1 << 20)
+	total = 0
+	while True:
+		count, _ = generator.next_into(buffer)
+		if not count:
+			return total
+		total += count
+
+def consume_next_block(generator):
+	total = 0
+	while True:
+		block = generator.next_block(1 << 18)
+		if not len(block):
+			return total
+		total += len(block)
+
+def main():
+	parser = argparse.ArgumentParser(description='BruteforceGenerator Benchmark', conflict_handler='resolve')
+	parser.add_argument('--mask', default='?l?l?l?l?d', help='the mask to generate candidates for')
+	arguments = parser.parse_args()
+
+	benchmark('iterator', utilities.BruteforceGenerator.from_mask(arguments.mask), consume_iterator)
+	benchmark('bytes', utilities.BruteforceGenerator.from_mask(arguments.mask, as_bytes=True), consume_iterator)
+	benchmark('next_into', utilities.BruteforceGenerator.from_mask(arguments.mask, as_bytes=True), consume_next_into)
+	if utilities.has_numpy:
+		benchmark('next_block', utilities.BruteforceGenerator.from_mask(arguments.mask), consume_next_block)
+	else:
+		print('numpy is unavailable, skipping the next_block benchmark')
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  benchmarks/multi_pattern_matcher.py
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions are
+#  met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following disclaimer
+#    in the documentation and/or other materials provided with the
+#    distribution.
+#  * Neither the name of the project nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+#  A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+#  LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#  DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+#  THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+#  (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+#  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from smoke_zephyr import utilities
+
+def random_ip():
+	return '.'.join(str(random.randint(1, 254)) for _ in range(4))
+
+def benchmark(name, count, data, search):
+	start = time.perf_counter()
+	matches = search(data)
+	elapsed = time.perf_counter() - start
+	print("{0:<12} {1:>7,} patterns {2:>8,} matches in {3:6.3f}s ({4:>8,.1f} MiB/s)".format(name, count, matches, elapsed, len(data) / elapsed / (1 << 20)))
+
+def main():
+	parser = argparse.ArgumentParser(description='MultiPatternMatcher Benchmark', conflict_handler='resolve')
+	parser.add_argument('--lines', default=200000, type=int, help='the number of log lines to search')
+	parser.add_argument('--naive', action='store_true', default=False, help='include a plain alternation for comparison (up to 100 patterns)')
+	arguments = parser.parse_args()
+
+	random.seed(0)
+	addresses = [(random_ip(), random_ip()) for _ in range(arguments.lines)]
+	lines = ["2020-01-01 00:00:{0:02} connection from {1} to {2} port {3}\n".format(index % 60, source, destination, random.randint(1, 65535)) for index, (source, destination) in enumerate(addresses)]
+	data = ''.join(lines)
+	for count in (10, 100, 1000, 10000):
+		# a tenth of the patterns occur in the data, each address is paired with its /24 prefix so finditer has to
+		# expand matches to the shorter patterns which share the same offset
+		patterns = []
+		for source, _ in random.sample(addresses, max(count // 20, 1)):
+			patterns.extend((source, source.rsplit('.', 1)[0] + '.'))
+		patterns.extend(random_ip() for _ in range(count - len(patterns)))
+		matcher = utilities.MultiPatternMatcher(patterns)
+		benchmark('search', count, data, lambda data: sum(1 for _ in matcher.regex.finditer(data)))
+		benchmark('finditer', count, data, lambda data: sum(1 for _ in matcher.finditer(data)))
+		if arguments.naive and count <= 100:
+			# a plain alternation is tried at every position and becomes far too slow beyond this
+			naive = re.compile('|'.join(re.escape(pattern) for pattern in patterns))
+			benchmark('naive', count, data, lambda data: sum(1 for _ in naive.finditer(data)))
+
+if __name__ == '__main__':
+	main()
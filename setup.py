@@ -77,13 +77,13 @@ setup(
 	url='https://github.com/zeroSteiner/smoke-zephyr',
 	license='BSD',
 	packages=['smoke_zephyr'],
+	python_requires='>=3.5',
 	classifiers=[
 		'Development Status :: 5 - Production/Stable',
 		'Intended Audience :: Developers',
 		'License :: OSI Approved :: BSD License',
 		'Operating System :: POSIX',
 		'Programming Language :: Python',
-		'Programming Language :: Python :: 3.4',
 		'Programming Language :: Python :: 3.5',
 		'Programming Language :: Python :: 3.6',
 		'Programming Language :: Python :: 3.7',
@@ -30,25 +30,72 @@
 #  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 
+import array
+import atexit
+import bisect
+import bz2
 import collections
+import concurrent.futures
+import copy
 import functools
+import gzip
+import hashlib
+import importlib.util
 import inspect
+import io
 import ipaddress
 import itertools
 import logging
+import mmap
+import multiprocessing
 import os
+import pickle
+import queue
 import random
 import re
 import shutil
+import sqlite3
+import stat
 import string
 import subprocess
 import sys
+import threading
 import time
 import unittest
 import urllib.parse
 import urllib.request
 import weakref
 
+# numpy is imported when it is first used because importing it is slow
+has_numpy = importlib.util.find_spec('numpy') is not None
+"""Whether the :py:mod:`numpy` module is available or not."""
+
+try:
+	import lzma
+except ImportError:
+	has_lzma = False
+	"""Whether the :py:mod:`lzma` module is available for searching xz compressed files or not."""
+else:
+	has_lzma = True
+
+# the errors raised while reading a file which has been truncated or is corrupt, including compressed files
+_READ_ERRORS = (EOFError, OSError) + ((lzma.LZMAError,) if has_lzma else ())
+
+CACHE_PERSIST_FORMAT_VERSION = 1
+"""The version of the file format used by :py:class:`.Cache` to persist entries."""
+# a fixed protocol is used for shared and persisted entries so they can be read by every supported version of python
+_CACHE_PICKLE_PROTOCOL = 4
+BRUTEFORCE_MASK_CHARSETS = {
+	'l': string.ascii_lowercase,
+	'u': string.ascii_uppercase,
+	'd': string.digits,
+	'h': string.digits + 'abcdef',
+	'H': string.digits + 'ABCDEF',
+	's': ' ' + string.punctuation,
+	'a': string.ascii_lowercase + string.ascii_uppercase + string.digits + ' ' + string.punctuation,
+	'b': ''.join(map(chr, range(0, 256)))
+}
+"""The named charsets which can be referenced in :py:meth:`.BruteforceGenerator.from_mask` masks."""
 EMAIL_REGEX = re.compile(r'^[a-z0-9._%+-]+@[a-z0-9.-]+\.[a-z]{2,6}$', flags=re.IGNORECASE)
 
 class AttributeDict(dict):
@@ -59,16 +106,150 @@ class AttributeDict(dict):
 	__getattr__ = dict.__getitem__
 	__setattr__ = dict.__setitem__
 
-class BruteforceGenerator(object):
+class _IndexedGenerator(object):
+	# the base class for generators which can address each of their candidates by index, subclasses must set the
+	# _start, _stop and _index attributes and implement _candidate and _product_from
+	def __getitem__(self, index):
+		keyspace = self.keyspace
+		if index < 0:
+			index += keyspace
+		if not 0 <= index < keyspace:
+			raise IndexError('candidate index out of range')
+		return self._candidate(self._start + index)
+
+	def __iter__(self):
+		return self
+
+	def __len__(self):
+		return self.keyspace
+
+	def __next__(self):
+		return self.next()
+
+	@property
+	def keyspace(self):
+		"""
+		The total number of candidates. Unlike :py:func:`len`, this is not
+		limited to :py:data:`sys.maxsize`.
+
+		.. versionadded:: 2.1.0
+
+		:rtype: int
+		"""
+		return self._stop - self._start
+
+	def partition(self, count):
+		"""
+		Split the candidates into *count* shards of nearly equal size. See
+		:py:meth:`.shard` for details.
+
+		.. versionadded:: 2.1.0
+
+		:param int count: The number of shards to create.
+		:return: The shards in order.
+		:rtype: list
+		"""
+		return [self.shard(shard_idx, count) for shard_idx in range(count)]
+
+	def run_parallel(self, callback, processes=None):
+		"""
+		Split the candidates into one shard per process and call *callback*
+		with each candidate in a :py:class:`multiprocessing.Pool`. The
+		callback must be picklable, for example a function defined at the top
+		level of a module.
+
+		.. versionadded:: 2.1.0
+
+		:param function callback: The function to call with each candidate.
+		:param int processes: The number of worker processes to use, defaults
+			to the number of CPUs.
+		:return: A list of each candidate and the result of *callback* for
+			which the result was not None, in candidate order.
+		:rtype: list
+		"""
+		processes = processes or multiprocessing.cpu_count()
+		pool = multiprocessing.Pool(processes)
+		try:
+			shard_results = pool.starmap(_bruteforce_worker, [(shard, callback) for shard in self.partition(processes)])
+		finally:
+			pool.close()
+			pool.join()
+		return list(itertools.chain.from_iterable(shard_results))
+
+	def seek(self, index):
+		"""
+		Set the position so the next candidate to be generated is the one at
+		*index*.
+
+		.. versionadded:: 2.1.0
+
+		:param int index: The index of the next candidate to generate.
+		"""
+		if index < 0:
+			index += self.keyspace
+		if not 0 <= index <= self.keyspace:
+			raise IndexError('candidate index out of range')
+		self._index = self._start + index
+		self._product = self._product_from(self._index)
+
+	def shard(self, shard_idx, count):
+		"""
+		Create a new generator for a contiguous range of the candidates. The
+		candidates are split into *count* ranges of nearly equal size which
+		do not overlap, allowing each one to be processed by a separate
+		worker.
+
+		.. versionadded:: 2.1.0
+
+		:param int shard_idx: The index of the shard to create.
+		:param int count: The total number of shards.
+		:return: A generator of the same type starting at the first candidate
+			of the shard.
+		"""
+		if not 0 <= shard_idx < count:
+			raise ValueError('shard_idx must be between 0 and count')
+		keyspace = self.keyspace
+		shard = copy.copy(self)
+		shard._start = self._start + (keyspace * shard_idx) // count
+		shard._stop = self._start + (keyspace * (shard_idx + 1)) // count
+		shard.seek(0)
+		return shard
+
+	def tell(self):
+		"""
+		Get the index of the next candidate to be generated, which is also the
+		number of candidates that have been generated so far when iteration
+		started from the beginning.
+
+		.. versionadded:: 2.1.0
+
+		:rtype: int
+		"""
+		return self._index - self._start
+
+class BruteforceGenerator(_IndexedGenerator):
 	"""
-	This class allows itarating sequences for bruteforcing.
+	This class allows itarating sequences for bruteforcing. Candidates are
+	ordered by length and then by the position of each character in the sorted
+	*charset*, allowing any candidate to be addressed directly by its index.
+
+	.. versionchanged:: 2.1.0
+		Added support for :py:func:`len`, indexing, seeking, sharding,
+		generating bytes, masks and checkpoints. The :py:attr:`.length`
+		attribute is now a read-only property.
 	"""
-	# requirments = itertools
-	def __init__(self, startlen, endlen=None, charset=None):
+	# requirments = bisect, copy, itertools, multiprocessing
+	def __init__(self, startlen, endlen=None, charset=None, as_bytes=False):
 		"""
+		.. versionchanged:: 2.1.0
+			Added the *as_bytes* parameter.
+
 		:param int startlen: The minimum sequence size to generate.
 		:param int endlen: The maximum sequence size to generate.
 		:param charset: The characters to include in the resulting sequences.
+		:param bool as_bytes: Whether to generate :py:class:`bytes` instead of
+			:py:class:`str` candidates. All characters in *charset* must be in
+			the range 0-255.
 		"""
 		self.startlen = startlen
 		if endlen is None:
@@ -83,45 +264,440 @@ class BruteforceGenerator(object):
 			charset = list(map(chr, charset))
 		charset.sort()
 		self.charset = tuple(charset)
-		self.length = self.startlen
-		self._product = itertools.product(self.charset, repeat=self.length)
+		self.mask = None
+		self._initialize((self.charset,) * self.endlen, as_bytes)
+
+	def _initialize(self, charsets, as_bytes):
+		self.as_bytes = as_bytes
+		if as_bytes:
+			if any(ord(char) > 0xff for char in self.charset):
+				raise ValueError('charset must only contain characters in the range 0-255 when as_bytes is set')
+			self._charsets = tuple(tuple(map(ord, charset)) for charset in charsets)
+			self._join = bytes
+		else:
+			self._charsets = tuple(charsets)
+			self._join = ''.join
+		# the index of the first candidate of each length, followed by the total number of candidates
+		self._offsets = [0]
+		for length in range(self.startlen, self.endlen + 1):
+			self._offsets.append(self._offsets[-1] + self._keyspace(length))
+		self._start = 0
+		self._stop = self._offsets[-1]
+		self._index = 0
+		self._product = self._product_from(0)
 		self._next = self.__next__
+		self._checkpoint_callback = None
+		self._checkpoint_interval = None
+		self._checkpoint_index = float('inf')
 
-	def __iter__(self):
-		return self
+	@classmethod
+	def from_mask(cls, mask, charsets=None, increment=False, as_bytes=False):
+		"""
+		Create a generator from a mask which specifies the characters to use
+		for each position. Positions are either a literal character or a
+		question mark followed by the name of a charset from
+		:py:data:`.BRUTEFORCE_MASK_CHARSETS`, a digit referring to a custom
+		charset or a second question mark for a literal one. For example,
+		``?u?l?l?l?l?l?d?d`` generates an uppercase letter followed by five
+		lowercase letters and two digits.
+
+		.. versionadded:: 2.1.0
+
+		:param str mask: The mask to generate candidates for.
+		:param dict charsets: Custom charsets keyed by their digit. Each value
+			may reference the built in charsets in the same syntax as *mask*.
+		:param bool increment: Whether to generate candidates for each prefix
+			of the mask from one position up to the full mask instead of only
+			the full mask.
+		:param bool as_bytes: Whether to generate :py:class:`bytes` instead of
+			:py:class:`str` candidates.
+		:return: The new generator.
+		:rtype: :py:class:`.BruteforceGenerator`
+		"""
+		custom_charsets = {}
+		for key, value in (charsets or {}).items():
+			custom_charsets[str(key)] = tuple(sorted(set(itertools.chain.from_iterable(_parse_mask(value)))))
+		positions = _parse_mask(mask, custom_charsets)
+		generator = cls.__new__(cls)
+		generator.startlen = 1 if increment else len(positions)
+		generator.endlen = len(positions)
+		generator.charset = tuple(sorted(set(itertools.chain.from_iterable(positions))))
+		generator.mask = mask
+		generator._initialize(positions, as_bytes)
+		return generator
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		del state['_next']
+		del state['_product']
+		# the checkpoint callback may not be picklable and copies should not share it
+		state['_checkpoint_callback'] = None
+		state['_checkpoint_interval'] = None
+		state['_checkpoint_index'] = float('inf')
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self._next = self.__next__
+		self._product = self._product_from(self._index)
+
+	def _candidate(self, index):
+		return self._join(charset[digit] for charset, digit in zip(self._charsets, self._digits(index)))
+
+	def _checkpoint(self):
+		self._checkpoint_index = self._index + self._checkpoint_interval
+		self._checkpoint_callback(self.state())
+
+	def _digits(self, index):
+		# convert an index into the mixed-radix digits of the candidate
+		length_idx = bisect.bisect_right(self._offsets, index) - 1
+		index -= self._offsets[length_idx]
+		digits = []
+		for charset in reversed(self._charsets[:self.startlen + length_idx]):
+			index, digit = divmod(index, len(charset))
+			digits.append(digit)
+		digits.reverse()
+		return digits
+
+	def _keyspace(self, length):
+		keyspace = 1
+		for charset in self._charsets[:length]:
+			keyspace *= len(charset)
+		return keyspace
+
+	def _product_from(self, index):
+		if index >= self._stop:
+			return iter(())
+		digits = self._digits(index)
+		products = itertools.chain(
+			(self._product_from_digits(digits),),
+			(itertools.product(*self._charsets[:length]) for length in range(len(digits) + 1, self.endlen + 1))
+		)
+		products = itertools.chain.from_iterable(products)
+		if self._stop == self._offsets[-1]:
+			return products
+		return itertools.islice(products, self._stop - index)
+
+	def _product_from_digits(self, digits):
+		charsets = self._charsets[:len(digits)]
+		if not any(digits):
+			return itertools.product(*charsets)
+		# the remaining candidates are the product of each position after it is incremented while the preceding
+		# positions are held in place, starting from the last position
+		products = []
+		for position in range(len(digits) - 1, -1, -1):
+			start = digits[position] + (0 if position == len(digits) - 1 else 1)
+			pools = [(charsets[idx][digits[idx]],) for idx in range(position)]
+			pools.append(charsets[position][start:])
+			pools.extend(charsets[position + 1:])
+			products.append(itertools.product(*pools))
+		return itertools.chain.from_iterable(products)
+
+	@property
+	def length(self):
+		"""
+		The length of the most recently generated candidate. Before any
+		candidates have been generated, this is the length of the first one.
 
-	def __next__(self):
-		return self.next()
+		:rtype: int
+		"""
+		index = max(self._index - 1, self._start)
+		return min(self.startlen + bisect.bisect_right(self._offsets, index) - 1, self.endlen)
+
+	@classmethod
+	def from_state(cls, state):
+		"""
+		Create a generator from the state returned by :py:meth:`.state`. The
+		new generator continues with the next candidate that had not yet been
+		generated when the state was saved.
+
+		.. versionadded:: 2.1.0
+
+		:param dict state: The saved state.
+		:return: The restored generator.
+		:rtype: :py:class:`.BruteforceGenerator`
+		"""
+		if state.get('version') != 1:
+			raise ValueError('unsupported state version')
+		positions = [tuple(charset) for charset in state['charsets']]
+		generator = cls.__new__(cls)
+		generator.startlen = state['startlen']
+		generator.endlen = state['endlen']
+		generator.charset = tuple(sorted(set(itertools.chain.from_iterable(positions))))
+		generator.mask = state['mask']
+		generator._initialize(positions, state['as_bytes'])
+		if not 0 <= state['start'] <= state['index'] <= state['stop'] <= generator._stop:
+			raise ValueError('the state position is out of range')
+		generator._start = state['start']
+		generator._stop = state['stop']
+		generator._index = state['index']
+		generator._product = generator._product_from(generator._index)
+		return generator
 
 	def next(self):
-		try:
-			value = next(self._product)
-		except StopIteration:
-			if self.length == self.endlen:
-				raise StopIteration
-			self.length += 1
-			self._product = itertools.product(self.charset, repeat=self.length)
-			value = next(self._product)
-		return ''.join(value)
+		if self._index >= self._checkpoint_index:
+			self._checkpoint()
+		value = next(self._product)
+		self._index += 1
+		return self._join(value)
+
+	def next_block(self, count):
+		"""
+		Generate a block of up to *count* candidates at once as a 2-D
+		:py:class:`numpy.ndarray` of :py:class:`numpy.uint8` values, with one
+		candidate per row. Each block is computed from the candidate indexes
+		using vectorized mixed-radix arithmetic. All candidates in a block have
+		the same length, so the block ends early when the next candidate is a
+		different length. All characters in the charset must be in the range
+		0-255. This requires :py:mod:`numpy` to be installed.
+
+		.. versionadded:: 2.1.0
+
+		:param int count: The maximum number of candidates to generate.
+		:return: The candidates, the array has no rows once all have been
+			generated.
+		:rtype: :py:class:`numpy.ndarray`
+		"""
+		if not has_numpy:
+			raise RuntimeError('next_block requires the numpy module')
+		import numpy
+		if self._index >= self._stop:
+			return numpy.empty((0, self.length), dtype=numpy.uint8)
+		if self._index >= self._checkpoint_index:
+			self._checkpoint()
+		length_idx = bisect.bisect_right(self._offsets, self._index) - 1
+		length = self.startlen + length_idx
+		count = min(count, min(self._offsets[length_idx + 1], self._stop) - self._index)
+		relative_index = self._index - self._offsets[length_idx]
+		if relative_index + count > 0xffffffffffffffff:
+			raise OverflowError('the candidate index is too large to be vectorized')
+		indexes = numpy.arange(relative_index, relative_index + count, dtype=numpy.uint64)
+		block = numpy.empty((count, length), dtype=numpy.uint8)
+		for position in range(length - 1, -1, -1):
+			charset = self._charsets[position]
+			table = numpy.array(charset if self.as_bytes else tuple(map(ord, charset)), dtype=numpy.uint16)
+			if int(table.max()) > 0xff:
+				raise ValueError('charset must only contain characters in the range 0-255 to generate blocks')
+			indexes, digits = numpy.divmod(indexes, numpy.uint64(len(charset)))
+			block[:, position] = table[digits]
+		self._index += count
+		self._product = self._product_from(self._index)
+		return block
+
+	def next_into(self, buffer):
+		"""
+		Write a batch of candidates into *buffer* back to back, without
+		creating an object for each one. All candidates in a batch have the
+		same length so the boundaries can be determined from the return value.
+		The batch ends early when the next candidate is a different length.
+		This is only available when *as_bytes* is set.
+
+		.. versionadded:: 2.1.0
+
+		:param buffer: The writable buffer to fill with candidates.
+		:type buffer: bytearray, memoryview
+		:return: The number of candidates written and their length. The
+			number of candidates is zero once all have been generated.
+		:rtype: tuple
+		"""
+		if not self.as_bytes:
+			raise RuntimeError('next_into requires the generator to be in as_bytes mode')
+		if self._index >= self._checkpoint_index:
+			self._checkpoint()
+		if self._index >= self._stop:
+			return 0, self.length
+		length_idx = bisect.bisect_right(self._offsets, self._index) - 1
+		length = self.startlen + length_idx
+		count = min(self._offsets[length_idx + 1], self._stop) - self._index
+		if length:
+			view = memoryview(buffer).cast('B')
+			count = min(count, len(view) // length)
+			if not count:
+				raise ValueError('the buffer is too small to hold a candidate')
+			view[:count * length] = bytes(itertools.chain.from_iterable(itertools.islice(self._product, count)))
+		else:
+			next(self._product)
+			count = 1
+		self._index += count
+		return count, length
+
+	def set_checkpoint(self, callback, interval):
+		"""
+		Periodically call *callback* with the value of :py:meth:`.state` while
+		generating candidates. The callback is called before the first
+		candidate of every *interval* is generated, at which point every
+		previous candidate has been consumed. Restoring the state with
+		:py:meth:`.from_state` will not generate them again.
+
+		.. versionadded:: 2.1.0
+
+		:param function callback: The function to call with the state or None
+			to disable checkpoints.
+		:param int interval: The number of candidates between checkpoints.
+		"""
+		self._checkpoint_callback = callback
+		if callback is None:
+			self._checkpoint_interval = None
+			self._checkpoint_index = float('inf')
+		else:
+			self._checkpoint_interval = interval
+			self._checkpoint_index = self._index + interval
+
+	def state(self):
+		"""
+		Get the current position along with the configuration of the generator
+		in a form which can be serialized as JSON and later restored with
+		:py:meth:`.from_state`.
+
+		.. versionadded:: 2.1.0
+
+		:rtype: dict
+		"""
+		charsets = []
+		for charset in self._charsets:
+			charsets.append(''.join(map(chr, charset)) if self.as_bytes else ''.join(charset))
+		return {
+			'version': 1,
+			'startlen': self.startlen,
+			'endlen': self.endlen,
+			'charsets': charsets,
+			'mask': self.mask,
+			'as_bytes': self.as_bytes,
+			'start': self._start,
+			'stop': self._stop,
+			'index': self._index
+		}
+
+def _parse_mask(mask, custom_charsets=None):
+	custom_charsets = custom_charsets or {}
+	positions = []
+	mask = iter(mask)
+	for char in mask:
+		if char != '?':
+			positions.append((char,))
+			continue
+		name = next(mask, None)
+		if name is None:
+			raise ValueError('mask can not end with an unescaped question mark')
+		if name == '?':
+			positions.append(('?',))
+		elif name in BRUTEFORCE_MASK_CHARSETS:
+			positions.append(tuple(sorted(set(BRUTEFORCE_MASK_CHARSETS[name]))))
+		elif name in custom_charsets:
+			positions.append(custom_charsets[name])
+		else:
+			raise ValueError("mask references the undefined charset '{0}'".format(name))
+	return positions
+
+def _bruteforce_worker(generator, callback):
+	results = []
+	for candidate in generator:
+		result = callback(candidate)
+		if result is not None:
+			results.append((candidate, result))
+	return results
+
+def _cache_key_canonical(key):
+	if type(key) is tuple:
+		return tuple(_cache_key_canonical(item) for item in key)
+	if isinstance(key, (frozenset, set)):
+		# the iteration order of a set depends on the hash seed of the process
+		return (frozenset, tuple(sorted(_cache_key_dumps(item) for item in key)))
+	return key
+
+def _cache_key_dumps(key):
+	# pickle a cache key so equal keys produce the same bytes in every process, the memo is disabled so objects
+	# which occur multiple times are not stored as references depending on their identity
+	file_h = io.BytesIO()
+	pickler = pickle.Pickler(file_h, _CACHE_PICKLE_PROTOCOL)
+	pickler.fast = True
+	pickler.dump(_cache_key_canonical(key))
+	return file_h.getvalue()
+
+def _estimate_size(obj):
+	# estimate the memory used by an object and the containers it references, an explicit stack
+	# is used so deeply nested objects do not exceed the recursion limit and shared objects such
+	# as modules, classes and functions are not counted
+	size = 0
+	seen = set()
+	stack = [obj]
+	while stack:
+		obj = stack.pop()
+		if id(obj) in seen or inspect.ismodule(obj) or inspect.isclass(obj) or inspect.isroutine(obj):
+			continue
+		seen.add(id(obj))
+		size += sys.getsizeof(obj)
+		if isinstance(obj, dict):
+			for key, value in obj.items():
+				stack.append(key)
+				stack.append(value)
+		elif isinstance(obj, (list, tuple, set, frozenset, collections.deque)):
+			stack.extend(obj)
+		elif hasattr(obj, '__dict__'):
+			stack.append(obj.__dict__)
+	return size
 
 _ArgSpec = collections.namedtuple('_ArgSpec', ('args', 'varargs', 'keywords', 'defaults'))
+_DiskUsage = collections.namedtuple('_DiskUsage', ('bytes', 'files', 'mtime'))
+_CacheInfo = collections.namedtuple('_CacheInfo', ('hits', 'misses', 'expirations', 'evictions', 'size', 'bytes'))
+_GrepLine = collections.namedtuple('_GrepLine', ('line_no', 'offset', 'line', 'context'))
 class Cache(object):
 	"""
 	This class provides a simple to use cache object which can be applied
 	as a decorator.
 	"""
-	def __init__(self, timeout):
+	def __init__(self, timeout, backend=None, persist=None, persist_interval=5, stale_ttl=None, max_bytes=None):
 		"""
+		.. versionchanged:: 2.1.0
+			Added the *backend*, *persist*, *persist_interval*, *stale_ttl* and
+			*max_bytes* parameters.
+
 		:param timeout: The amount of time in seconds that a cached
 			result will be considered valid for.
 		:type timeout: int, str
+		:param backend: An optional shared storage backend to use behind the
+			in-process cache. Results which are not found in the in-process
+			cache will be looked up in the backend before the function is
+			called. Calls to methods are only cached in-process.
+		:type backend: :py:class:`.CacheBackend`
+		:param str persist: An optional path to a file to persist entries to.
+			Unexpired entries are loaded from the file when the function is
+			decorated. Files written for a different function or format
+			version are ignored.
+		:param float persist_interval: The number of seconds to batch new
+			entries for before writing them to the *persist* file.
+		:param stale_ttl: An optional amount of time in seconds after an entry
+			has expired for which the stale result will still be returned. The
+			stale entry is refreshed in the background by a shared worker
+			thread so callers do not wait for the function to be called.
+		:type stale_ttl: int, str
+		:param int max_bytes: An optional limit on the estimated size of the
+			in-process cache. When the limit is exceeded, the least recently
+			used entries are evicted.
 		"""
 		if isinstance(timeout, str):
 			timeout = parse_timespan(timeout)
+		if isinstance(stale_ttl, str):
+			stale_ttl = parse_timespan(stale_ttl)
 		self.cache_timeout = timeout
+		self.cache_stale_ttl = stale_ttl or 0
+		self.cache_max_bytes = max_bytes
+		self.backend = backend
+		self.persist = persist
+		self.persist_interval = persist_interval
+		self._persist_dirty = False
+		self._persist_timer = None
+		self._persist_lock = threading.Lock()
 		self._target_function = None
 		self._target_function_arg_spec = None
-		self.__cache = {}
+		self._namespace = None
+		self._refreshing = set()
+		self._refreshing_pid = os.getpid()
+		self._stats = collections.Counter()
+		self.__cache = collections.OrderedDict()
+		self.__cache_bytes = 0
+		self.__cache_lock = threading.RLock()
+		self.__cache_sizes = {}
 		self.__obj = None
 
 	def __get__(self, instance, _):
@@ -139,35 +715,98 @@ class Cache(object):
 				raise RuntimeError('the cached function can not use dynamic args or kwargs')
 			self._target_function = target_function
 			self._target_function_arg_spec = arg_spec
+			self._namespace = target_function.__module__ + '.' + target_function.__qualname__
+			if self.persist:
+				self._persist_load()
+				atexit.register(self._persist_flush)
 			return functools.wraps(target_function)(self)
 
-		self.cache_clean()
-		if self.__obj is not None:
-			args = (self.__obj,) + args
-			self.__obj = None
-			is_method = True
-		else:
-			is_method = False
-		args = self._flatten_args(args, kwargs)
-		if is_method:
-			inst = args.popleft()
-			args = tuple(args)
-			ref = weakref.ref(inst, functools.partial(self._ref_callback, args))
-			cache_args = (ref,) + args
-			args = (inst,) + args
-		else:
-			cache_args = tuple(args)
-			args = tuple(args)
-		result, expiration = self.__cache.get(cache_args, (None, 0))
-		if expiration > time.time():
+		self._cache_clean()
+		inst = self.__obj
+		self.__obj = None
+		cache_args, args, is_method = self._cache_args(inst, args, kwargs)
+		found, result = self._cache_get(cache_args, args, is_method)
+		if found:
 			return result
+		if self.backend is not None and not is_method:
+			result, expiration = self.backend.get(self._namespace, cache_args) or (None, 0)
+			if expiration > time.time():
+				self._stats['hits'] += 1
+				with self.__cache_lock:
+					self._cache_set(cache_args, (result, expiration))
+				return result
+		self._stats['misses'] += 1
 		result = self._target_function(*args)
-		self.__cache[cache_args] = (result, time.time() + self.cache_timeout)
+		self._cache_store(cache_args, result, is_method)
 		return result
 
 	def __repr__(self):
 		return "<cached function {0} at 0x{1:x}>".format(self._target_function.__name__, id(self._target_function))
 
+	def _cache_args(self, inst, args, kwargs):
+		if inst is not None:
+			args = (inst,) + args
+		args = self._flatten_args(args, kwargs)
+		if inst is None:
+			args = tuple(args)
+			return args, args, False
+		args.popleft()
+		args = tuple(args)
+		ref = weakref.ref(inst, functools.partial(self._ref_callback, args))
+		return (ref,) + args, (inst,) + args, True
+
+	def _cache_clean(self):
+		now = time.time() - self.cache_stale_ttl
+		with self.__cache_lock:
+			keys_for_removal = collections.deque()
+			for key, (_, expiration) in self.__cache.items():
+				if expiration < now:
+					keys_for_removal.append(key)
+			for key in keys_for_removal:
+				self._cache_pop(key)
+			self._stats['expirations'] += len(keys_for_removal)
+
+	def _cache_get(self, cache_args, args, is_method):
+		now = time.time()
+		result, expiration = self.__cache.get(cache_args, (None, 0))
+		if expiration + self.cache_stale_ttl <= now:
+			return False, None
+		self._stats['hits'] += 1
+		if self.cache_max_bytes is not None:
+			with self.__cache_lock:
+				if cache_args in self.__cache:
+					self.__cache.move_to_end(cache_args)
+		if expiration <= now:
+			self._refresh_schedule(cache_args, args, is_method)
+		return True, result
+
+	def _cache_pop(self, key):
+		self.__cache.pop(key, None)
+		self.__cache_bytes -= self.__cache_sizes.pop(key, 0)
+
+	def _cache_set(self, key, entry):
+		self._cache_pop(key)
+		self.__cache[key] = entry
+		if self.cache_max_bytes is None:
+			return
+		size = _estimate_size(key) + _estimate_size(entry[0])
+		self.__cache_sizes[key] = size
+		self.__cache_bytes += size
+		while self.__cache and self.__cache_bytes > self.cache_max_bytes:
+			self._cache_pop(next(iter(self.__cache)))
+			self._stats['evictions'] += 1
+
+	def _cache_store(self, cache_args, result, is_method):
+		expiration = time.time() + self.cache_timeout
+		with self.__cache_lock:
+			self._cache_set(cache_args, (result, expiration))
+		if is_method:
+			return
+		if self.backend is not None:
+			self.backend.set(self._namespace, cache_args, result, expiration)
+		if self.persist:
+			self._persist_schedule()
+
 	def _flatten_args(self, args, kwargs):
 		flattened_args = collections.deque(args)
 		arg_spec = self._target_function_arg_spec
@@ -190,38 +829,493 @@ class Cache(object):
 			raise TypeError("{0}() got an unexpected keyword argument{1} {2}".format(self._target_function.__name__, ('' if len(unexpected_kwargs) == 1 else 's'), ', '.join(unexpected_kwargs)))
 		return flattened_args
 
+	def _persist_flush(self):
+		if not self._persist_dirty:
+			return
+		try:
+			self.cache_flush()
+		except OSError:
+			pass
+
+	def _persist_load(self):
+		try:
+			with open(self.persist, 'rb') as file_h:
+				data = pickle.load(file_h)
+		except Exception:  # pylint: disable=broad-except
+			# missing, corrupt and unreadable files, such as ones written with a newer pickle protocol, are ignored
+			return
+		if not isinstance(data, dict):
+			return
+		if data.get('version') != CACHE_PERSIST_FORMAT_VERSION or data.get('namespace') != self._namespace:
+			return
+		entries = data.get('entries')
+		if not isinstance(entries, list):
+			return
+		now = time.time()
+		for entry in entries:
+			try:
+				key, result, expiration = pickle.loads(entry)
+				if expiration > now:
+					with self.__cache_lock:
+						self._cache_set(key, (result, expiration))
+			except Exception:  # pylint: disable=broad-except
+				continue
+
+	def _persist_schedule(self):
+		with self._persist_lock:
+			self._persist_dirty = True
+			if self._persist_timer is not None:
+				return
+			self._persist_timer = threading.Timer(self.persist_interval, self._persist_flush)
+			self._persist_timer.daemon = True
+			self._persist_timer.start()
+
 	def _ref_callback(self, args, ref):
 		args = (ref,) + args
-		self.__cache.pop(args, None)
+		with self.__cache_lock:
+			self._cache_pop(args)
+
+	def _refresh(self, cache_args, args, is_method):
+		try:
+			self._cache_store(cache_args, self._target_function(*args), is_method)
+		except Exception:  # pylint: disable=broad-except
+			# the stale entry is left in place and will be dropped when the stale window ends
+			pass
+		finally:
+			with self.__cache_lock:
+				self._refreshing.discard(cache_args)
+
+	def _refresh_schedule(self, cache_args, args, is_method):
+		with self.__cache_lock:
+			if self._refreshing_pid != os.getpid():
+				# refreshes which were pending when the process forked are never run in the child
+				self._refreshing = set()
+				self._refreshing_pid = os.getpid()
+			if cache_args in self._refreshing:
+				return
+			self._refreshing.add(cache_args)
+		_CacheRefreshWorker.submit(functools.partial(self._refresh, cache_args, args, is_method))
+
+	def map(self, iterable, batch_loader=None):
+		"""
+		Look up the results for many sets of arguments at once. Results which
+		are cached are returned directly while the missing ones are retrieved
+		from the backend in a single request and then computed. All new
+		results are stored in one pass.
+
+		.. versionadded:: 2.1.0
+
+		:param iterable: The positional arguments for each call. Items which
+			are not tuples are used as the only argument.
+		:param batch_loader: An optional function to compute all missing
+			results at once instead of calling the cached function for each. It
+			is passed a list of the argument tuples and must return a sequence
+			of results in the same order.
+		:type batch_loader: function
+		:return: The results in the same order as *iterable*.
+		:rtype: list
+		"""
+		self._cache_clean()
+		inst = self.__obj
+		self.__obj = None
+		results = []
+		misses = collections.OrderedDict()
+		for args in iterable:
+			if not isinstance(args, tuple):
+				args = (args,)
+			cache_args, args, is_method = self._cache_args(inst, args, {})
+			found, result = self._cache_get(cache_args, args, is_method)
+			if found:
+				results.append(result)
+				continue
+			results.append(None)
+			misses.setdefault(cache_args, (args, []))[1].append(len(results) - 1)
+		if not misses:
+			return results
+
+		if self.backend is not None and inst is None:
+			now = time.time()
+			for cache_args, (result, expiration) in self.backend.get_many(self._namespace, tuple(misses.keys())).items():
+				if expiration <= now:
+					continue
+				self._stats['hits'] += 1
+				with self.__cache_lock:
+					self._cache_set(cache_args, (result, expiration))
+				for position in misses.pop(cache_args)[1]:
+					results[position] = result
+			if not misses:
+				return results
+
+		self._stats['misses'] += len(misses)
+		if batch_loader is None:
+			new_results = [self._target_function(*args) for args, _ in misses.values()]
+		else:
+			new_results = batch_loader([args for args, _ in misses.values()])
+			if len(new_results) != len(misses):
+				raise ValueError('the batch loader returned the wrong number of results')
+		expiration = time.time() + self.cache_timeout
+		entries = {}
+		with self.__cache_lock:
+			for (cache_args, (_, positions)), result in zip(misses.items(), new_results):
+				self._cache_set(cache_args, (result, expiration))
+				entries[cache_args] = (result, expiration)
+				for position in positions:
+					results[position] = result
+		if inst is None:
+			if self.backend is not None:
+				self.backend.set_many(self._namespace, entries)
+			if self.persist:
+				self._persist_schedule()
+		return results
 
 	def cache_clean(self):
 		"""
 		Remove expired items from the cache.
 		"""
-		now = time.time()
-		keys_for_removal = collections.deque()
-		for key, (_, expiration) in self.__cache.items():
-			if expiration < now:
-				keys_for_removal.append(key)
-		for key in keys_for_removal:
-			del self.__cache[key]
+		self._cache_clean()
+		if self.backend is not None:
+			self.backend.clean()
+
+	def cache_info(self):
+		"""
+		Get statistics about the in-process cache. The *bytes* field is an
+		estimate of the memory used by the cached keys and results.
+
+		.. versionadded:: 2.1.0
+
+		:return: The hits, misses, expirations, evictions, size and bytes.
+		:rtype: tuple
+		"""
+		with self.__cache_lock:
+			if self.cache_max_bytes is None:
+				cache_bytes = sum(_estimate_size(key) + _estimate_size(result) for key, (result, _) in self.__cache.items())
+			else:
+				cache_bytes = self.__cache_bytes
+			return _CacheInfo(
+				hits=self._stats['hits'],
+				misses=self._stats['misses'],
+				expirations=self._stats['expirations'],
+				evictions=self._stats['evictions'],
+				size=len(self.__cache),
+				bytes=cache_bytes
+			)
 
 	def cache_clear(self):
 		"""
 		Remove all items from the cache.
 		"""
-		self.__cache = {}
+		with self.__cache_lock:
+			self.__cache = collections.OrderedDict()
+			self.__cache_bytes = 0
+			self.__cache_sizes = {}
+		if self.backend is not None and self._namespace is not None:
+			self.backend.clear(self._namespace)
+		if self.persist:
+			self._persist_schedule()
+
+	def cache_flush(self):
+		"""
+		Write all unexpired entries to the *persist* file immediately. Entries
+		which can not be pickled and calls to methods are not written. This is
+		a no-op when persistence is not enabled.
+
+		.. versionadded:: 2.1.0
+		"""
+		if not self.persist:
+			return
+		with self._persist_lock:
+			if self._persist_timer is not None:
+				self._persist_timer.cancel()
+				self._persist_timer = None
+			self._persist_dirty = False
+			now = time.time()
+			with self.__cache_lock:
+				items = list(self.__cache.items())
+			entries = []
+			for key, (result, expiration) in items:
+				if expiration < now or (key and isinstance(key[0], weakref.ref)):
+					continue
+				try:
+					entries.append(pickle.dumps((key, result, expiration), _CACHE_PICKLE_PROTOCOL))
+				except (AttributeError, pickle.PicklingError, TypeError):
+					continue
+			data = {'version': CACHE_PERSIST_FORMAT_VERSION, 'namespace': self._namespace, 'entries': entries}
+			# write to a temporary file and rename it so readers never see a partial file
+			tmp_path = "{0}.{1}.tmp".format(self.persist, os.getpid())
+			with open(tmp_path, 'wb') as file_h:
+				pickle.dump(data, file_h, _CACHE_PICKLE_PROTOCOL)
+			os.replace(tmp_path, self.persist)
+
+class _CacheRefreshWorker(object):
+	# a single daemon thread shared by all Cache instances for refreshing stale entries
+	_lock = threading.Lock()
+	_queue = None
+	_thread = None
+	_thread_pid = None
+
+	@classmethod
+	def _run(cls, task_queue):
+		while True:
+			task = task_queue.get()
+			task()
+
+	@classmethod
+	def submit(cls, task):
+		with cls._lock:
+			# the thread does not exist in a child process after a fork so a new one is started
+			if cls._thread is None or cls._thread_pid != os.getpid() or not cls._thread.is_alive():
+				cls._queue = queue.Queue()
+				cls._thread = threading.Thread(target=cls._run, args=(cls._queue,), name='CacheRefreshWorker')
+				cls._thread.daemon = True
+				cls._thread.start()
+				cls._thread_pid = os.getpid()
+			cls._queue.put(task)
+
+class CacheBackend(object):
+	"""
+	The base class for shared storage backends which can be used by
+	:py:class:`.Cache` instances. Entries are stored within a namespace which
+	is unique to each cached function, allowing a single backend instance to
+	be shared between multiple functions.
+
+	.. versionadded:: 2.1.0
+	"""
+	def get(self, namespace, key):
+		"""
+		Retrieve an entry from the backend.
+
+		:param str namespace: The namespace of the cached function.
+		:param tuple key: The arguments the function was called with.
+		:return: The cached result and its expiration timestamp or None if the
+			entry is unavailable.
+		:rtype: tuple
+		"""
+		raise NotImplementedError()
+
+	def get_many(self, namespace, keys):
+		"""
+		Retrieve multiple entries from the backend. Backends which can perform
+		this in a single operation should override this method.
+
+		.. versionadded:: 2.1.0
+
+		:param str namespace: The namespace of the cached function.
+		:param tuple keys: The keys of the entries to retrieve.
+		:return: A mapping of the available keys to their cached result and
+			expiration timestamp.
+		:rtype: dict
+		"""
+		entries = {}
+		for key in keys:
+			entry = self.get(namespace, key)
+			if entry is not None:
+				entries[key] = entry
+		return entries
+
+	def set(self, namespace, key, result, expiration):
+		"""
+		Store an entry in the backend.
+
+		:param str namespace: The namespace of the cached function.
+		:param tuple key: The arguments the function was called with.
+		:param result: The result of the function.
+		:param float expiration: The timestamp at which the entry expires.
+		"""
+		raise NotImplementedError()
+
+	def set_many(self, namespace, entries):
+		"""
+		Store multiple entries in the backend. Backends which can perform this
+		in a single operation should override this method.
+
+		.. versionadded:: 2.1.0
+
+		:param str namespace: The namespace of the cached function.
+		:param dict entries: A mapping of keys to their result and expiration
+			timestamp.
+		"""
+		for key, (result, expiration) in entries.items():
+			self.set(namespace, key, result, expiration)
+
+	def clean(self):
+		"""
+		Remove expired entries from the backend.
+		"""
+		raise NotImplementedError()
+
+	def clear(self, namespace):
+		"""
+		Remove all entries within *namespace* from the backend.
+
+		:param str namespace: The namespace of the cached function.
+		"""
+		raise NotImplementedError()
+
+class _PathMatcher(object):
+	# matches paths against gitignore style patterns which are compiled into a single regular expression, patterns
+	# without a slash match the name at any depth, a trailing slash only matches directories and ** matches any
+	# number of directories
+	def __init__(self, patterns):
+		regexes = []
+		for pattern in patterns:
+			pattern = pattern.strip()
+			if not pattern or pattern.startswith('#'):
+				continue
+			if pattern.startswith('!'):
+				raise ValueError("negated patterns are not supported: '{0}'".format(pattern))
+			if pattern.startswith(('\\!', '\\#')):
+				# a leading backslash escapes a literal exclamation mark or hash
+				pattern = pattern[1:]
+			dir_only = pattern.endswith('/')
+			pattern = pattern.rstrip('/')
+			if '/' in pattern:
+				regex = '^' + self._translate(pattern.lstrip('/'))
+			else:
+				regex = '^(?:.*/)?' + self._translate(pattern)
+			regexes.append(regex + ('/$' if dir_only else '/?$'))
+		self.regex = re.compile('|'.join('(?:' + regex + ')' for regex in regexes) or '(?!)')
+
+	@staticmethod
+	def _translate(pattern):
+		regex = ''
+		idx = 0
+		while idx < len(pattern):
+			char = pattern[idx]
+			if pattern.startswith('**/', idx):
+				regex += '(?:.*/)?'
+				idx += 3
+				continue
+			elif pattern.startswith('**', idx):
+				regex += '.*'
+				idx += 2
+				continue
+			elif char == '*':
+				regex += '[^/]*'
+			elif char == '?':
+				regex += '[^/]'
+			elif char == '[' and ']' in pattern[idx + 2:]:
+				end = pattern.index(']', idx + 2)
+				body = pattern[idx + 1:end]
+				if body.startswith('!'):
+					body = '^' + body[1:]
+				regex += '[' + body.replace('\\', '\\\\') + ']'
+				idx = end + 1
+				continue
+			else:
+				regex += re.escape(char)
+			idx += 1
+		return regex
+
+	def match(self, prefix, name, is_dir):
+		return self.regex.match(prefix + name + ('/' if is_dir else '')) is not None
+
+class _PathEntry(object):
+	# an os.DirEntry compatible object for paths which were not found by scanning a directory
+	def __init__(self, path):
+		self.path = path
+		self.name = os.path.basename(path)
+		self._stat = None
+		self._lstat = None
+
+	def __fspath__(self):
+		return self.path
+
+	def __repr__(self):
+		return "<{0} {1!r}>".format(self.__class__.__name__, self.name)
+
+	def inode(self):
+		return self.stat(follow_symlinks=False).st_ino
+
+	def is_dir(self, follow_symlinks=True):
+		try:
+			return stat.S_ISDIR(self.stat(follow_symlinks=follow_symlinks).st_mode)
+		except OSError:
+			return False
+
+	def is_file(self, follow_symlinks=True):
+		try:
+			return stat.S_ISREG(self.stat(follow_symlinks=follow_symlinks).st_mode)
+		except OSError:
+			return False
+
+	def is_symlink(self):
+		try:
+			return stat.S_ISLNK(self.stat(follow_symlinks=False).st_mode)
+		except OSError:
+			return False
+
+	def stat(self, follow_symlinks=True):
+		if not follow_symlinks:
+			if self._lstat is None:
+				self._lstat = os.lstat(self.path)
+			return self._lstat
+		if self._stat is None:
+			self._stat = os.stat(self.path)
+		return self._stat
+
+class _FileWalkerAsyncIterator(object):
+	# directories are scanned in batches by a thread pool only once all previous results have been consumed
+	def __init__(self, walker):
+		self.walker = walker
+		self.workers = walker.workers or 4
+		self._executor = concurrent.futures.ThreadPoolExecutor(self.workers)
+		self._directories = collections.deque()
+		if os.path.isdir(walker.filespath) and walker.max_depth > 0:
+			self._directories.append((walker.filespath, 0))
+		self._results = collections.deque()
+		self._finished = False
+
+	def __aiter__(self):
+		return self
+
+	async def __anext__(self):
+		# asyncio is only imported when it is needed because importing it is slow
+		import asyncio
+		loop = asyncio.get_event_loop()
+		while not self._results:
+			if self._finished:
+				raise StopAsyncIteration()
+			if not self._directories:
+				# the root is returned last, matching the synchronous iterator
+				self._results.extend(await loop.run_in_executor(self._executor, list, self.walker._next_file()))
+				self._finished = True
+				self._executor.shutdown(wait=False)
+				continue
+			batch = [self._directories.popleft() for _ in range(min(self.workers, len(self._directories)))]
+			scans = await asyncio.gather(*(loop.run_in_executor(self._executor, self.walker._scan, path) for path, _ in batch))
+			for (_, depth), (results, subdirectories) in zip(batch, scans):
+				if depth + 1 < self.walker.max_depth:
+					self._directories.extend((entry.path, depth + 1) for entry in subdirectories)
+				self._results.extend(results)
+		return self._results.popleft()
+
+	async def aclose(self):
+		self._finished = True
+		self._directories.clear()
+		self._results.clear()
+		self._executor.shutdown(wait=False)
 
 class FileWalker(object):
 	"""
 	This class is used to easily iterate over files and subdirectories of a
-	specified parent directory.
+	specified parent directory. In addition to regular iteration, instances
+	support asynchronous iteration with ``async for`` in which case
+	directories are scanned in batches by a pool of *workers* threads (4 by
+	default) without blocking the event loop. New directories are only
+	scanned once the results of the previous batch have been consumed.
+
+	.. versionchanged:: 2.1.0
+		Added support for asynchronous iteration.
 	"""
-	def __init__(self, filespath, absolute_path=False, skip_files=False, skip_dirs=False, filter_func=None, follow_links=False, max_depth=None):
+	def __init__(self, filespath, absolute_path=False, skip_files=False, skip_dirs=False, filter_func=None, follow_links=False, max_depth=None, yield_entries=False, workers=None, ordered=True, include=None, exclude=None):
 		"""
 		.. versionchanged:: 1.4.0
 			Added the *follow_links* and *max_depth* parameters.
 
+		.. versionchanged:: 2.1.0
+			Added the *yield_entries*, *workers*, *ordered*, *include* and
+			*exclude* parameters.
+
 		:param str filespath: A path to either a file or a directory. If
 			a file is passed then that will be the only file returned
 			during the iteration. If a directory is passed, all files and
@@ -236,6 +1330,26 @@ class FileWalker(object):
 		:param bool follow_links: Whether or not to follow directories pointed
 			to by symlinks.
 		:param max_depth: A maximum depth to recurse into.
+		:param bool yield_entries: Whether to yield :py:class:`os.DirEntry`
+			compatible objects instead of paths. The entries are also passed to
+			*filter_func* and cache the information retrieved while scanning
+			the directory, avoiding additional calls to :py:func:`os.stat`.
+		:param int workers: The number of threads to use for scanning
+			directories concurrently, which is beneficial on high latency
+			storage. When set, *filter_func* is called from the worker threads.
+		:param bool ordered: Whether results from concurrent scans should be
+			yielded in the same order as a serial walk, or as soon as they are
+			available.
+		:param include: Glob patterns in the style of a gitignore file, if
+			defined only paths matching at least one pattern are returned.
+			Directories are descended into regardless. Negated patterns
+			starting with ``!`` are not supported and raise a
+			:py:exc:`ValueError`.
+		:type include: list, tuple
+		:param exclude: Glob patterns in the style of a gitignore file for
+			paths to skip. Directories which match are not descended into.
+			Negated patterns are not supported either.
+		:type exclude: list, tuple
 		"""
 		if not (os.path.isfile(filespath) or os.path.isdir(filespath)):
 			raise Exception(filespath + ' is neither a file or directory')
@@ -248,43 +1362,810 @@ class FileWalker(object):
 		self.filter_func = filter_func
 		self.follow_links = follow_links
 		self.max_depth = float('inf') if max_depth is None else max_depth
+		self.yield_entries = yield_entries
+		self.workers = workers
+		self.ordered = ordered
+		self._include = _PathMatcher(include) if include else None
+		self._exclude = _PathMatcher(exclude) if exclude else None
+		# the length of the path prefix to remove for matching patterns, filespath may end with a separator such as /
+		self._prefix_length = len(os.path.join(self.filespath, ''))
 		if os.path.isdir(self.filespath):
-			self._walk = None
-			self._next = self._next_dir
+			if workers and workers > 1:
+				self._next = self._next_dir_ordered if ordered else self._next_dir_unordered
+			else:
+				self._next = self._next_dir
 		elif os.path.isfile(self.filespath):
 			self._next = self._next_file
 
+	def __aiter__(self):
+		return _FileWalkerAsyncIterator(self)
+
 	def __iter__(self):
 		return self._next()
 
-	def _skip(self, cur_file):
-		if self.skip_files and os.path.isfile(cur_file):
+	def _scan(self, path):
+		# list a directory returning the results to yield and the subdirectory entries to descend into
+		results = []
+		subdirectories = []
+		try:
+			entries = list(os.scandir(path))
+		except OSError:
+			return results, subdirectories
+		dirs = []
+		files = []
+		included = set()
+		if self._exclude is not None or self._include is not None:
+			prefix = path[self._prefix_length:].replace(os.sep, '/')
+			prefix = prefix + '/' if prefix else ''
+		for entry in entries:
+			try:
+				is_dir = entry.is_dir()
+			except OSError:
+				is_dir = False
+			if self._exclude is not None and self._exclude.match(prefix, entry.name, is_dir):
+				continue
+			if self._include is not None and self._include.match(prefix, entry.name, is_dir):
+				included.add(entry.name)
+			(dirs if is_dir else files).append(entry)
+		for entry in itertools.chain(dirs, files):
+			if self._include is not None and entry.name not in included:
+				continue
+			if not self._skip(entry):
+				results.append(entry if self.yield_entries else entry.path)
+		for entry in dirs:
+			if self.follow_links or not entry.is_symlink():
+				subdirectories.append(entry)
+		return results, subdirectories
+
+	def _skip(self, entry):
+		if self.skip_files and entry.is_file():
 			return True
-		if self.skip_dirs and os.path.isdir(cur_file):
+		if self.skip_dirs and entry.is_dir():
 			return True
 		if self.filter_func is not None:
-			if not self.filter_func(cur_file):
+			if not self.filter_func(entry if self.yield_entries else entry.path):
 				return True
 		return False
 
 	def _next_dir(self):
-		for root, dirs, files in os.walk(self.filespath, followlinks=self.follow_links):
-			if root == self.filespath:
-				depth = 0
-			else:
-				depth = os.path.relpath(root, start=self.filespath).count(os.path.sep) + 1
+		directories = [(self.filespath, 0)]
+		while directories:
+			path, depth = directories.pop()
 			if depth >= self.max_depth:
 				continue
-			for entry in itertools.chain(dirs, files):
-				current_path = os.path.join(root, entry)
-				if not self._skip(current_path):
-					yield current_path
-		if self.max_depth >= 0 and not self._skip(self.filespath):
-			yield self.filespath
+			results, subdirectories = self._scan(path)
+			for result in results:
+				yield result
+			directories.extend((entry.path, depth + 1) for entry in reversed(subdirectories))
+		yield from self._next_file()
+
+	def _next_dir_ordered(self):
+		# the next directories are scanned ahead of time while results are yielded in the same order as _next_dir
+		prefetch = self.workers * 4
+		executor = concurrent.futures.ThreadPoolExecutor(self.workers)
+		directories = [[self.filespath, 0, None]] if self.max_depth > 0 else []
+		try:
+			while directories:
+				submitted = 0
+				for directory in reversed(directories):
+					if directory[2] is None:
+						directory[2] = executor.submit(self._scan, directory[0])
+					submitted += 1
+					if submitted == prefetch:
+						break
+				_, depth, future = directories.pop()
+				results, subdirectories = future.result()
+				if depth + 1 < self.max_depth:
+					directories.extend([entry.path, depth + 1, None] for entry in reversed(subdirectories))
+				for result in results:
+					yield result
+		finally:
+			for directory in directories:
+				if directory[2] is not None:
+					directory[2].cancel()
+			executor.shutdown(wait=True)
+		yield from self._next_file()
+
+	def _next_dir_unordered(self):
+		# at most a fixed number of scans are pending at a time, results are yielded as each one finishes
+		pending_limit = self.workers * 4
+		executor = concurrent.futures.ThreadPoolExecutor(self.workers)
+		directories = collections.deque([(self.filespath, 0)] if self.max_depth > 0 else [])
+		pending = {}
+		try:
+			while directories or pending:
+				while directories and len(pending) < pending_limit:
+					path, depth = directories.popleft()
+					pending[executor.submit(self._scan, path)] = depth
+				done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+				for future in done:
+					depth = pending.pop(future)
+					results, subdirectories = future.result()
+					if depth + 1 < self.max_depth:
+						directories.extend((entry.path, depth + 1) for entry in subdirectories)
+					for result in results:
+						yield result
+		finally:
+			for future in pending:
+				future.cancel()
+			executor.shutdown(wait=True)
+		yield from self._next_file()
 
 	def _next_file(self):
-		if self.max_depth >= 0 and not self._skip(self.filespath):
-			yield self.filespath
+		entry = _PathEntry(self.filespath)
+		if self.max_depth >= 0 and not self._skip(entry):
+			yield entry if self.yield_entries else self.filespath
+
+	def _snapshot_report(self, rel_path, is_dir):
+		if (self.skip_files and not is_dir) or (self.skip_dirs and is_dir):
+			return False
+		if self._include is not None:
+			prefix, _, name = rel_path.rpartition('/')
+			if not self._include.match(prefix + '/' if prefix else '', name, is_dir):
+				return False
+		if self.filter_func is not None:
+			path = os.path.join(self.filespath, *rel_path.split('/'))
+			if not self.filter_func(_PathEntry(path) if self.yield_entries else path):
+				return False
+		return True
+
+	def _disk_usage_scan(self, path, inodes):
+		usage = [0, 0, 0]
+		subdirectories = []
+		try:
+			entries = list(os.scandir(path))
+		except OSError:
+			return usage, iter(subdirectories)
+		prefix = None
+		if self._exclude is not None:
+			prefix = path[self._prefix_length:].replace(os.sep, '/')
+			prefix = prefix + '/' if prefix else ''
+		for entry in entries:
+			try:
+				is_dir = entry.is_dir(follow_symlinks=self.follow_links)
+				if self._exclude is not None and self._exclude.match(prefix, entry.name, is_dir):
+					continue
+				if is_dir:
+					subdirectories.append(entry.path)
+					continue
+				entry_stat = entry.stat(follow_symlinks=False)
+			except OSError:
+				continue
+			if entry_stat.st_nlink > 1:
+				inode = (entry_stat.st_dev, entry_stat.st_ino)
+				if inode in inodes:
+					continue
+				inodes.add(inode)
+			usage[0] += entry_stat.st_size
+			usage[1] += 1
+			usage[2] = max(usage[2], entry_stat.st_mtime)
+		return usage, iter(subdirectories)
+
+	def disk_usage(self, max_depth=None):
+		"""
+		Calculate the total size in bytes, number of files and newest
+		modification time of the files within each directory, including all
+		of its subdirectories. The tree is scanned in a single pass and files
+		with multiple hard links are only counted once. Directories are
+		yielded as soon as their totals are complete, so each one is yielded
+		after its subdirectories. The *skip_files*, *skip_dirs*, *include*,
+		*filter_func* and *max_depth* options of the walker are not used.
+
+		.. versionadded:: 2.1.0
+
+		:param int max_depth: The maximum depth of directories to yield totals
+			for, the totals always include the entire tree.
+		:return: A generator yielding tuples of each directory and its usage.
+		"""
+		if not os.path.isdir(self.filespath):
+			raise RuntimeError('disk usage can only be calculated for directories')
+		max_depth = float('inf') if max_depth is None else max_depth
+		inodes = set()
+		usage, subdirectories = self._disk_usage_scan(self.filespath, inodes)
+		directories = [(self.filespath, 0, usage, subdirectories)]
+		while directories:
+			path, depth, usage, subdirectories = directories[-1]
+			subdirectory = next(subdirectories, None)
+			if subdirectory is not None:
+				sub_usage, sub_subdirectories = self._disk_usage_scan(subdirectory, inodes)
+				directories.append((subdirectory, depth + 1, sub_usage, sub_subdirectories))
+				continue
+			directories.pop()
+			if directories:
+				parent_usage = directories[-1][2]
+				parent_usage[0] += usage[0]
+				parent_usage[1] += usage[1]
+				parent_usage[2] = max(parent_usage[2], usage[2])
+			if depth <= max_depth:
+				yield path, _DiskUsage(*usage)
+
+	def changes(self, snapshot_path, stat_files=True):
+		"""
+		Compare the directory tree to the snapshot saved in *snapshot_path*
+		by the previous call and yield the paths which were added, modified
+		or removed. A new snapshot is saved once all changes have been
+		yielded. Snapshots record the inode, size and modification time of
+		each path. Directories whose modification time is unchanged are not
+		scanned again because no entries can have been added to or removed
+		from them.
+
+		.. versionadded:: 2.1.0
+
+		:param str snapshot_path: The path to the snapshot file, if it does not
+			exist every path is reported as added.
+		:param bool stat_files: Whether to check the files in unchanged
+			directories for modifications. When disabled, the cost of a walk
+			only depends on the number of directories which changed but
+			files modified in place are not detected.
+		:return: A generator yielding tuples of the change, one of ``added``,
+			``modified`` or ``removed``, and the path.
+		"""
+		if not os.path.isdir(self.filespath):
+			raise RuntimeError('changes can only be tracked for directories')
+		root = os.path.abspath(self.filespath)
+		try:
+			with open(snapshot_path, 'rb') as file_h:
+				snapshot = pickle.load(file_h)
+		except (OSError, EOFError, pickle.UnpicklingError):
+			snapshot = None
+		if not isinstance(snapshot, dict) or snapshot.get('version') != 1 or snapshot.get('root') != root:
+			snapshot = {'entries': {}, 'children': {}}
+		old_entries = snapshot['entries']
+		old_children = snapshot['children']
+		entries = {}
+		children = {}
+
+		def removed(rel_path):
+			paths = [rel_path]
+			while paths:
+				rel_path = paths.pop()
+				is_dir = old_entries[rel_path][3]
+				if self._snapshot_report(rel_path, is_dir):
+					yield 'removed', os.path.join(self.filespath, *rel_path.split('/'))
+				if is_dir:
+					paths.extend(rel_path + '/' + name for name in reversed(old_children.get(rel_path, ())))
+
+		try:
+			root_stat = os.stat(self.filespath)
+		except OSError:
+			return
+		entries[''] = (root_stat.st_ino, 0, root_stat.st_mtime_ns, True)
+		directories = [('', 0)] if self.max_depth > 0 else []
+		while directories:
+			rel_dir, depth = directories.pop()
+			path = os.path.join(self.filespath, *rel_dir.split('/')) if rel_dir else self.filespath
+			prefix = rel_dir + '/' if rel_dir else ''
+			subdirectories = []
+			if rel_dir in old_entries and rel_dir in old_children and old_entries[rel_dir][2] == entries[rel_dir][2]:
+				# the directory is unchanged so the names of its entries are reused from the snapshot
+				names = old_children[rel_dir]
+				for name in names:
+					rel_path = prefix + name
+					old_entry = old_entries[rel_path]
+					if old_entry[3] or not stat_files:
+						entry = old_entry
+						if old_entry[3]:
+							try:
+								entry_stat = os.stat(os.path.join(path, name))
+							except OSError:
+								entry_stat = None
+							if entry_stat is not None:
+								entry = (entry_stat.st_ino, 0, entry_stat.st_mtime_ns, True)
+					else:
+						try:
+							entry_stat = os.stat(os.path.join(path, name))
+						except OSError:
+							entry = old_entry
+						else:
+							entry = (entry_stat.st_ino, entry_stat.st_size, entry_stat.st_mtime_ns, False)
+							if entry[:3] != old_entry[:3] and self._snapshot_report(rel_path, False):
+								yield 'modified', os.path.join(path, name)
+					entries[rel_path] = entry
+					if entry[3]:
+						subdirectories.append(name)
+				children[rel_dir] = names
+			else:
+				try:
+					scanned = list(os.scandir(path))
+				except OSError:
+					scanned = []
+				names = []
+				for dir_entry in scanned:
+					try:
+						is_dir = dir_entry.is_dir()
+						entry_stat = dir_entry.stat()
+					except OSError:
+						continue
+					if self._exclude is not None and self._exclude.match(prefix, dir_entry.name, is_dir):
+						continue
+					if is_dir and not self.follow_links and dir_entry.is_symlink():
+						is_dir = False
+					rel_path = prefix + dir_entry.name
+					entry = (entry_stat.st_ino, 0 if is_dir else entry_stat.st_size, entry_stat.st_mtime_ns, is_dir)
+					old_entry = old_entries.get(rel_path)
+					if old_entry is not None and old_entry[3] != is_dir:
+						for change in removed(rel_path):
+							yield change
+						old_entry = None
+					if old_entry is None:
+						if self._snapshot_report(rel_path, is_dir):
+							yield 'added', dir_entry.path
+					elif not is_dir and entry[:3] != old_entry[:3] and self._snapshot_report(rel_path, False):
+						yield 'modified', dir_entry.path
+					entries[rel_path] = entry
+					names.append(dir_entry.name)
+					if is_dir:
+						subdirectories.append(dir_entry.name)
+				for name in old_children.get(rel_dir, ()):
+					if prefix + name not in entries:
+						for change in removed(prefix + name):
+							yield change
+				children[rel_dir] = tuple(names)
+			if depth + 1 < self.max_depth:
+				directories.extend((prefix + name, depth + 1) for name in reversed(subdirectories))
+
+		snapshot = {'version': 1, 'root': root, 'entries': entries, 'children': children}
+		tmp_path = "{0}.{1}.tmp".format(snapshot_path, os.getpid())
+		with open(tmp_path, 'wb') as file_h:
+			pickle.dump(snapshot, file_h, pickle.HIGHEST_PROTOCOL)
+		os.replace(tmp_path, snapshot_path)
+
+class _GrepTextPattern(object):
+	# a str pattern which can not be searched for in encoded data, the lines containing a match of the bytes prefilter
+	# (or every line when no prefilter could be determined) are decoded and searched with the pattern itself
+	_line = re.compile(b'.+', re.DOTALL)
+	def __init__(self, pattern, prefilter, encoding):
+		self.pattern = pattern
+		self.prefilter = prefilter
+		self.encoding = encoding
+
+	def search(self, data, pos=0, endpos=None):
+		if endpos is None:
+			endpos = len(data)
+		while pos < endpos:
+			if self.prefilter is None:
+				line_start = pos
+			else:
+				match = self.prefilter.search(data, pos, endpos)
+				if match is None:
+					return None
+				line_start = data.rfind(b'\n', pos, match.start()) + 1 or pos
+			line_end = data.find(b'\n', line_start, endpos) + 1 or endpos
+			line = data[line_start:line_end].decode(self.encoding, 'replace')
+			match = self.pattern.search(line)
+			# an empty match after the line terminator belongs to the following line, matching _grep_search_line
+			if match is not None and (match.start() < len(line) or not line.endswith('\n')):
+				# the whole line is returned as the match
+				return self._line.match(data, line_start, line_end)
+			pos = line_end
+		return None
+
+class HybridGenerator(_IndexedGenerator):
+	"""
+	This class generates candidates by combining each word from a wordlist
+	with every candidate of a mask, in the syntax used by
+	:py:meth:`.BruteforceGenerator.from_mask`. The wordlist is memory-mapped
+	and read lazily, empty lines are skipped. Candidates are ordered by word
+	and then by the mask, allowing them to be indexed, sharded and resumed in
+	the same way as :py:class:`.BruteforceGenerator`.
+
+	Determining the number of candidates requires the wordlist to be read once
+	to build an index of the words, this is done on demand.
+
+	.. versionadded:: 2.1.0
+	"""
+	def __init__(self, wordlist, mask, charsets=None, prepend=False, encoding='utf-8', errors='strict'):
+		"""
+		:param str wordlist: The path to the wordlist file.
+		:param str mask: The mask to combine with each word.
+		:param dict charsets: Custom charsets for the mask.
+		:param bool prepend: Whether to place the mask candidate before the
+			word instead of after it.
+		:param str encoding: The encoding of the wordlist file.
+		:param str errors: How to handle words which can not be decoded with
+			*encoding*, as used by :py:meth:`bytes.decode`. For example,
+			``surrogateescape`` preserves the original bytes of each word
+			which can be restored by encoding candidates the same way.
+		"""
+		self.wordlist = wordlist
+		self.mask = mask
+		self.charsets = charsets
+		self.prepend = prepend
+		self.encoding = encoding
+		self.errors = errors
+		self._word_offsets = None
+		self._start = 0
+		self._shard_stop = None
+		self._index = 0
+		self._open()
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		del state['_mmap']
+		del state['_product']
+		del state['_segment']
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self._open()
+
+	def _candidate(self, index):
+		word_idx, mask_idx = divmod(index, self._segment.keyspace)
+		word = next(self._words_from(word_idx))
+		return self._segment[mask_idx] + word if self.prepend else word + self._segment[mask_idx]
+
+	def _open(self):
+		self._segment = BruteforceGenerator.from_mask(self.mask, charsets=self.charsets)
+		with open(self.wordlist, 'rb') as file_h:
+			if os.fstat(file_h.fileno()).st_size:
+				self._mmap = mmap.mmap(file_h.fileno(), 0, access=mmap.ACCESS_READ)
+			else:
+				self._mmap = b''
+		self._product = self._product_from(self._index)
+
+	def _product_from(self, index):
+		segment_keyspace = self._segment.keyspace
+		if not segment_keyspace:
+			return iter(())
+		word_idx, mask_idx = divmod(index, segment_keyspace)
+		candidates = self._product_from_word(word_idx, mask_idx)
+		if self._shard_stop is None:
+			return candidates
+		return itertools.islice(candidates, max(self._shard_stop - index, 0))
+
+	def _product_from_word(self, word_idx, mask_idx):
+		segment = copy.copy(self._segment)
+		for word in self._words_from(word_idx):
+			segment.seek(mask_idx)
+			mask_idx = 0
+			if self.prepend:
+				for value in segment:
+					yield value + word
+			else:
+				for value in segment:
+					yield word + value
+
+	@property
+	def _stop(self):
+		if self._shard_stop is None:
+			return len(self._word_index()) * self._segment.keyspace
+		return self._shard_stop
+
+	@_stop.setter
+	def _stop(self, value):
+		self._shard_stop = value
+
+	def _word_index(self):
+		if self._word_offsets is not None:
+			return self._word_offsets
+		word_offsets = array.array('Q')
+		data = self._mmap
+		position = 0
+		while position < len(data):
+			end = data.find(b'\n', position)
+			if end == -1:
+				end = len(data)
+			if data[position:end].rstrip(b'\r'):
+				word_offsets.append(position)
+			position = end + 1
+		self._word_offsets = word_offsets
+		return word_offsets
+
+	def _words_from(self, word_idx):
+		data = self._mmap
+		if word_idx:
+			word_offsets = self._word_index()
+			if word_idx >= len(word_offsets):
+				return
+			position = word_offsets[word_idx]
+		else:
+			position = 0
+		while position < len(data):
+			end = data.find(b'\n', position)
+			if end == -1:
+				end = len(data)
+			word = data[position:end].rstrip(b'\r')
+			position = end + 1
+			if word:
+				yield word.decode(self.encoding, self.errors)
+
+	def close(self):
+		"""
+		Close the memory-mapped wordlist, after which no more candidates can
+		be generated. The wordlist is shared with the generators created by
+		:py:meth:`.shard` which must not be used afterwards either.
+		"""
+		if isinstance(self._mmap, mmap.mmap):
+			self._mmap.close()
+		self._mmap = b''
+		self._product = iter(())
+
+	@classmethod
+	def from_state(cls, state):
+		"""
+		Create a generator from the state returned by :py:meth:`.state`.
+
+		:param dict state: The saved state.
+		:return: The restored generator.
+		:rtype: :py:class:`.HybridGenerator`
+		"""
+		if state.get('version') != 1:
+			raise ValueError('unsupported state version')
+		generator = cls(state['wordlist'], state['mask'], charsets=state['charsets'], prepend=state['prepend'], encoding=state['encoding'], errors=state.get('errors', 'strict'))
+		generator._start = state['start']
+		generator._shard_stop = state['stop']
+		generator._index = state['index']
+		generator._product = generator._product_from(generator._index)
+		return generator
+
+	def next(self):
+		value = next(self._product)
+		self._index += 1
+		return value
+
+	def state(self):
+		"""
+		Get the current position along with the configuration of the generator
+		in a form which can be serialized as JSON and later restored with
+		:py:meth:`.from_state`.
+
+		:rtype: dict
+		"""
+		return {
+			'version': 1,
+			'wordlist': self.wordlist,
+			'mask': self.mask,
+			'charsets': self.charsets,
+			'prepend': self.prepend,
+			'encoding': self.encoding,
+			'errors': self.errors,
+			'start': self._start,
+			'stop': self._shard_stop,
+			'index': self._index
+		}
+
+class MultiPatternMatcher(object):
+	"""
+	This class is used to efficiently search for a large number of literal
+	patterns at once, such as a list of indicators. The patterns are compiled
+	into a single regular expression which is structured as a trie so the
+	cost of matching at each position grows with the length of the patterns
+	and only slowly with the number of them, unlike a plain alternation which
+	tries each pattern in turn. Overlapping occurrences are found by
+	matching the trie within a lookahead and patterns which are prefixes of a
+	longer match are found by expansion, providing the same results as the
+	Aho-Corasick algorithm. Instances can be used as the expression for
+	:py:func:`.grep`, :py:func:`.grep_files` and :py:func:`.grep_iter`.
+
+	.. versionadded:: 2.1.0
+	"""
+	def __init__(self, patterns, ignore_case=False):
+		"""
+		:param patterns: The literal patterns to search for.
+		:type patterns: list, set, tuple
+		:param bool ignore_case: Whether to match the patterns case-insensitively.
+		"""
+		patterns = [pattern for pattern in unique(patterns) if pattern]
+		if not patterns:
+			raise ValueError('at least one non-empty pattern must be specified')
+		self.is_bytes = isinstance(patterns[0], bytes)
+		if not all(isinstance(pattern, bytes) == self.is_bytes for pattern in patterns):
+			raise TypeError('patterns must be either all str or all bytes')
+		self.ignore_case = ignore_case
+		self.patterns = tuple(patterns)
+		# patterns are stored by key, which is always a str so bytes are decoded with latin-1
+		self._patterns = collections.defaultdict(list)
+		trie = {}
+		for pattern in patterns:
+			key = self._key(pattern)
+			self._patterns[key].append(pattern)
+			node = trie
+			for character in key:
+				node = node.setdefault(character, {})
+			node[None] = True
+		self._prefixes = {}
+		for key in self._patterns:
+			node = trie
+			prefixes = []
+			for index, character in enumerate(key, 1):
+				node = node[character]
+				if None in node:
+					prefixes.append(key[:index])
+			self._prefixes[key] = tuple(prefixes)
+		expression = self._trie_expression(trie)
+		flags = re.IGNORECASE if ignore_case else 0
+		if self.is_bytes:
+			self.regex = re.compile(expression.encode('latin-1'), flags)
+			self._overlapped = re.compile(('(?=(' + expression + '))').encode('latin-1'), flags)
+		else:
+			self.regex = re.compile(expression, flags)
+			self._overlapped = re.compile('(?=(' + expression + '))', flags)
+
+	def __len__(self):
+		return len(self.patterns)
+
+	def __repr__(self):
+		return "<{0} patterns={1} >".format(self.__class__.__name__, len(self.patterns))
+
+	def _key(self, data):
+		if self.ignore_case:
+			data = data.lower()
+		if self.is_bytes:
+			data = data.decode('latin-1')
+		return data
+
+	@classmethod
+	def _trie_expression(cls, node):
+		terminal = None in node
+		branches = []
+		characters = []
+		for character, child in sorted((character, child) for character, child in node.items() if character is not None):
+			if len(child) == 1 and None in child:
+				characters.append(re.escape(character))
+			else:
+				branches.append(re.escape(character) + cls._trie_expression(child))
+		# a single character or character class does not need to be grouped to be optional
+		atomic = characters and not branches
+		if len(characters) == 1:
+			branches.append(characters[0])
+		elif characters:
+			branches.append('[' + ''.join(characters) + ']')
+		if not branches:
+			return ''
+		expression = '|'.join(branches)
+		if terminal:
+			return expression + '?' if atomic else '(?:' + expression + ')?'
+		if len(branches) > 1:
+			return '(?:' + expression + ')'
+		return expression
+
+	def finditer(self, data):
+		"""
+		Find every occurrence of each pattern within *data*, including ones
+		which overlap.
+
+		:param data: The data to search.
+		:type data: bytes, str
+		:return: A generator yielding a tuple of the offset and pattern for
+			each occurrence, ordered by offset and then length.
+		"""
+		for match in self._overlapped.finditer(data):
+			offset = match.start()
+			for key in self._prefixes[self._key(match.group(1))]:
+				for pattern in self._patterns[key]:
+					yield offset, pattern
+
+	def matches(self, data):
+		"""
+		Get the patterns which occur within *data*.
+
+		:param data: The data to search.
+		:type data: bytes, str
+		:return: The patterns which were found.
+		:rtype: set
+		"""
+		return set(pattern for _, pattern in self.finditer(data))
+
+	def search(self, data):
+		"""
+		Find the first occurrence of any of the patterns within *data*. If
+		multiple patterns start at the same offset, the longest one is
+		returned.
+
+		:param data: The data to search.
+		:type data: bytes, str
+		:return: A tuple of the offset and pattern, or None if no pattern was found.
+		:rtype: tuple
+		"""
+		match = self.regex.search(data)
+		if match is None:
+			return None
+		return match.start(), self._patterns[self._key(match.group(0))][0]
+
+class SQLiteCacheBackend(CacheBackend):
+	"""
+	A :py:class:`.CacheBackend` which stores pickled entries in a SQLite
+	database, allowing results to be shared between processes on the same
+	host. Keys are pickled in a canonical form so equal arguments share an
+	entry regardless of their identity or the hash seed of each process.
+	Entries whose keys or values can not be pickled are not stored.
+
+	.. versionadded:: 2.1.0
+	"""
+	def __init__(self, path, timeout=30):
+		"""
+		:param str path: The path to the SQLite database file.
+		:param float timeout: The number of seconds to wait on the database
+			lock held by another process.
+		"""
+		self.path = path
+		self.timeout = timeout
+		self._connection = None
+		self._connection_pid = None
+		self._lock = threading.RLock()
+
+	def _connect(self):
+		# connections can not be shared with child processes so a new one is opened after a fork
+		if self._connection is not None and self._connection_pid == os.getpid():
+			return self._connection
+		connection = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False, isolation_level=None)
+		connection.execute('PRAGMA journal_mode=WAL')
+		connection.execute(
+			'CREATE TABLE IF NOT EXISTS cache ('
+			'namespace TEXT NOT NULL, key BLOB NOT NULL, value BLOB NOT NULL, expiration REAL NOT NULL, '
+			'PRIMARY KEY (namespace, key))'
+		)
+		self._connection = connection
+		self._connection_pid = os.getpid()
+		return connection
+
+	def _execute(self, *args):
+		with self._lock:
+			return self._connect().execute(*args).fetchall()
+
+	def get(self, namespace, key):
+		try:
+			key = _cache_key_dumps(key)
+		except (AttributeError, pickle.PicklingError, TypeError, ValueError):
+			return None
+		rows = self._execute('SELECT value, expiration FROM cache WHERE namespace = ? AND key = ? AND expiration > ?', (namespace, key, time.time()))
+		if not rows:
+			return None
+		value, expiration = rows[0]
+		return pickle.loads(value), expiration
+
+	def get_many(self, namespace, keys):
+		pickled_keys = {}
+		for key in keys:
+			try:
+				pickled_keys[_cache_key_dumps(key)] = key
+			except (AttributeError, pickle.PicklingError, TypeError, ValueError):
+				continue
+		entries = {}
+		now = time.time()
+		pickled_keys_list = tuple(pickled_keys.keys())
+		# stay below the default limit on the number of host parameters in a query
+		for offset in range(0, len(pickled_keys_list), 500):
+			chunk = pickled_keys_list[offset:offset + 500]
+			rows = self._execute(
+				'SELECT key, value, expiration FROM cache WHERE namespace = ? AND expiration > ? AND key IN (' + ', '.join('?' * len(chunk)) + ')',
+				(namespace, now) + chunk
+			)
+			for key, value, expiration in rows:
+				entries[pickled_keys[key]] = (pickle.loads(value), expiration)
+		return entries
+
+	def set(self, namespace, key, result, expiration):
+		try:
+			key = _cache_key_dumps(key)
+			value = pickle.dumps(result, _CACHE_PICKLE_PROTOCOL)
+		except (AttributeError, pickle.PicklingError, TypeError, ValueError):
+			return
+		self._execute('INSERT OR REPLACE INTO cache (namespace, key, value, expiration) VALUES (?, ?, ?, ?)', (namespace, key, value, expiration))
+
+	def set_many(self, namespace, entries):
+		rows = []
+		for key, (result, expiration) in entries.items():
+			try:
+				rows.append((namespace, _cache_key_dumps(key), pickle.dumps(result, _CACHE_PICKLE_PROTOCOL), expiration))
+			except (AttributeError, pickle.PicklingError, TypeError, ValueError):
+				continue
+		with self._lock:
+			connection = self._connect()
+			connection.execute('BEGIN')
+			try:
+				connection.executemany('INSERT OR REPLACE INTO cache (namespace, key, value, expiration) VALUES (?, ?, ?, ?)', rows)
+			except Exception:
+				connection.execute('ROLLBACK')
+				raise
+			connection.execute('COMMIT')
+
+	def clean(self):
+		self._execute('DELETE FROM cache WHERE expiration < ?', (time.time(),))
+
+	def clear(self, namespace):
+		self._execute('DELETE FROM cache WHERE namespace = ?', (namespace,))
 
 class SectionConfigParser(object):
 	"""
@@ -404,6 +2285,381 @@ class TestCase(unittest.TestCase):
 		if not hasattr(self, 'assertRaisesRegex') and hasattr(self, 'assertRaisesRegexp'):
 			self.assertRaisesRegex = self.assertRaisesRegexp
 
+class TrigramIndex(object):
+	"""
+	An on-disk index of the trigrams contained within a set of files, used to
+	speed up repeated searches of the same corpus. Each file is split into
+	blocks which end on line boundaries so a line never spans two blocks, and
+	the blocks containing each trigram are stored in a SQLite database. When
+	searching, the literal strings that every match must contain are
+	extracted from the expression and only the blocks which contain all of
+	their trigrams are searched with the real expression. Expressions for
+	which no literal of at least three characters can be determined fall back
+	to searching every indexed file. Trigrams are indexed with ASCII letters
+	folded to lowercase so the index can be used regardless of the search
+	flags, when ignoring case only the ASCII parts of literals are used.
+
+	Files are only indexed again by :py:meth:`.update` when their size or
+	modification time changes and files which have changed since they were
+	indexed are searched in their entirety, so results are always accurate.
+	Compressed files are indexed and searched as described in
+	:py:func:`.grep`.
+
+	.. versionadded:: 2.1.0
+	"""
+	_segment_size = 256
+	def __init__(self, path, block_size=65536, timeout=30):
+		"""
+		:param str path: The path to the SQLite database file.
+		:param int block_size: The approximate size of each block in bytes.
+		:param float timeout: The number of seconds to wait on the database
+			lock held by another process.
+		"""
+		self.path = path
+		self.block_size = block_size
+		self.timeout = timeout
+		self._connection = None
+		self._connection_pid = None
+		self._lock = threading.RLock()
+
+	def _candidates(self, conjunctions):
+		# find the blocks of each file which contain every trigram from at least one of the conjunctions
+		candidates = collections.defaultdict(set)
+		for trigrams in conjunctions:
+			trigrams = tuple(trigrams)
+			# start with the rarest trigrams so the fewest rows need to be loaded for the rest
+			sizes = {}
+			# stay below the default limit on the number of host parameters in a query
+			for offset in range(0, len(trigrams), 500):
+				chunk = trigrams[offset:offset + 500]
+				sizes.update(self._execute(
+					'SELECT trigram, SUM(LENGTH(blocks)) FROM trigrams WHERE trigram IN (' + ', '.join('?' * len(chunk)) + ') GROUP BY trigram',
+					chunk
+				))
+			if len(sizes) < len(trigrams):
+				continue
+			matches = None
+			for trigram in sorted(trigrams, key=sizes.get):
+				if matches is None:
+					rows = self._execute('SELECT file_id, blocks FROM trigrams WHERE trigram = ?', (trigram,))
+				else:
+					file_ids = tuple(matches.keys())
+					rows = []
+					for offset in range(0, len(file_ids), 500):
+						chunk = file_ids[offset:offset + 500]
+						rows.extend(self._execute(
+							'SELECT file_id, blocks FROM trigrams WHERE trigram = ? AND file_id IN (' + ', '.join('?' * len(chunk)) + ')',
+							(trigram,) + chunk
+						))
+				blocks = collections.defaultdict(set)
+				for file_id, value in rows:
+					block_numbers = array.array('I')
+					block_numbers.frombytes(value)
+					blocks[file_id].update(block_numbers)
+				if matches is not None:
+					blocks = dict((file_id, matches[file_id] & block_numbers) for file_id, block_numbers in blocks.items())
+				matches = dict((file_id, block_numbers) for file_id, block_numbers in blocks.items() if block_numbers)
+				if not matches:
+					break
+			for file_id, block_numbers in matches.items():
+				candidates[file_id].update(block_numbers)
+		return candidates
+
+	def _connect(self):
+		# connections can not be shared with child processes so a new one is opened after a fork
+		if self._connection is not None and self._connection_pid == os.getpid():
+			return self._connection
+		connection = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False, isolation_level=None)
+		connection.execute('PRAGMA journal_mode=WAL')
+		connection.execute('CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE, size INTEGER NOT NULL, mtime INTEGER NOT NULL)')
+		connection.execute(
+			'CREATE TABLE IF NOT EXISTS blocks ('
+			'file_id INTEGER NOT NULL, block INTEGER NOT NULL, offset INTEGER NOT NULL, length INTEGER NOT NULL, line_no INTEGER NOT NULL, '
+			'PRIMARY KEY (file_id, block)) WITHOUT ROWID'
+		)
+		connection.execute(
+			'CREATE TABLE IF NOT EXISTS trigrams ('
+			'trigram INTEGER NOT NULL, file_id INTEGER NOT NULL, segment INTEGER NOT NULL, blocks BLOB NOT NULL, '
+			'PRIMARY KEY (trigram, file_id, segment)) WITHOUT ROWID'
+		)
+		connection.execute('CREATE INDEX IF NOT EXISTS trigrams_file_id ON trigrams (file_id)')
+		self._connection = connection
+		self._connection_pid = os.getpid()
+		return connection
+
+	def _execute(self, *args):
+		with self._lock:
+			return self._connect().execute(*args).fetchall()
+
+	def _index_file(self, connection, path, file_stat):
+		connection.execute('DELETE FROM files WHERE path = ?', (path,))
+		file_id = connection.execute('INSERT INTO files (path, size, mtime) VALUES (?, ?, ?)', (path, file_stat.st_size, file_stat.st_mtime_ns)).lastrowid
+		try:
+			file_h = _grep_open(path)
+		except OSError:
+			return
+		with file_h:
+			block = 0
+			offset = 0
+			line_no = 1
+			segment = []
+			try:
+				while True:
+					data = file_h.read(self.block_size)
+					if not data or (not block and b'\0' in data[:8192]):
+						# binary files are not indexed and can not be found, matching grep_files
+						break
+					if not data.endswith(b'\n'):
+						data += file_h.readline()
+					connection.execute('INSERT INTO blocks (file_id, block, offset, length, line_no) VALUES (?, ?, ?, ?, ?)', (file_id, block, offset, len(data), line_no))
+					segment.append(data.lower())
+					if len(segment) == self._segment_size:
+						self._index_segment(connection, file_id, block // self._segment_size, segment)
+						segment = []
+					block += 1
+					offset += len(data)
+					line_no += data.count(b'\n')
+			except _READ_ERRORS:
+				# truncated or corrupt compressed files, such as logs which are still being written, are
+				# indexed up to the error and indexed again once their size or modification time changes
+				pass
+			if segment:
+				self._index_segment(connection, file_id, block // self._segment_size, segment)
+
+	def _index_segment(self, connection, file_id, segment, blocks):
+		# store the blocks of the segment containing each trigram as an array of block numbers
+		first_block = segment * self._segment_size
+		if has_numpy:
+			import numpy
+			keys = []
+			for block, data in enumerate(blocks, first_block):
+				data = numpy.frombuffer(data, dtype=numpy.uint8).astype(numpy.uint64)
+				trigrams = (data[:-2] << numpy.uint64(16)) | (data[1:-1] << numpy.uint64(8)) | data[2:]
+				keys.append((numpy.unique(trigrams) << numpy.uint64(32)) | numpy.uint64(block))
+			keys = numpy.unique(numpy.concatenate(keys))
+			trigrams = keys >> numpy.uint64(32)
+			block_numbers = (keys & numpy.uint64(0xffffffff)).astype(numpy.uint32)
+			boundaries = numpy.flatnonzero(numpy.diff(trigrams)) + 1
+			rows = (
+				(int(trigrams[start]), file_id, segment, block_numbers[start:end].tobytes())
+				for start, end in zip(itertools.chain((0,), boundaries), itertools.chain(boundaries, (len(keys),)))
+				if start < end
+			)
+		else:
+			postings = collections.defaultdict(lambda: array.array('I'))
+			for block, data in enumerate(blocks, first_block):
+				for trigram in set(zip(data, data[1:], data[2:])):
+					postings[(trigram[0] << 16) | (trigram[1] << 8) | trigram[2]].append(block)
+			rows = ((trigram, file_id, segment, block_numbers.tobytes()) for trigram, block_numbers in postings.items())
+		connection.executemany('INSERT INTO trigrams (trigram, file_id, segment, blocks) VALUES (?, ?, ?, ?)', rows)
+
+	def _remove(self, connection, path):
+		row = connection.execute('SELECT id FROM files WHERE path = ?', (path,)).fetchone()
+		if row is None:
+			return
+		connection.execute('DELETE FROM trigrams WHERE file_id = ?', row)
+		connection.execute('DELETE FROM blocks WHERE file_id = ?', row)
+		connection.execute('DELETE FROM files WHERE id = ?', row)
+
+	def close(self):
+		"""Close the connection to the database."""
+		with self._lock:
+			if self._connection is not None and self._connection_pid == os.getpid():
+				self._connection.close()
+			self._connection = None
+
+	def search(self, expression, flags=0, encoding='utf-8'):
+		"""
+		Search the indexed files for lines that match a regular expression.
+
+		:param expression: The regex to search for.
+		:type expression: str, bytes, :py:class:`re.Pattern`, :py:class:`.MultiPatternMatcher`
+		:param int flags: The regex flags to use when searching.
+		:param str encoding: The encoding to use for encoding the expression and decoding lines.
+		:return: A generator yielding a tuple of the path, line number and line
+			for each matching line, ordered by path.
+		"""
+		pattern = _grep_compile(expression, flags | re.MULTILINE, encoding=encoding)
+		if isinstance(expression, MultiPatternMatcher):
+			literals = [[literal] for literal in expression.patterns]
+		else:
+			literals = _regex_literals(expression, flags)
+		if isinstance(pattern, _GrepTextPattern):
+			# str patterns also fold these ASCII letters to non-ASCII characters such as the kelvin sign
+			ignore_case = pattern.pattern.flags & re.IGNORECASE
+			unfolded = re.compile(b'[\x80-\xff]|[iksIKS]')
+		else:
+			ignore_case = pattern.flags & re.IGNORECASE
+			unfolded = re.compile(b'[\x80-\xff]')
+		conjunctions = None
+		if literals is not None:
+			conjunctions = []
+			for conjunction in literals:
+				trigrams = set()
+				for literal in conjunction:
+					if isinstance(literal, str):
+						literal = literal.encode(encoding)
+					# trigrams are indexed with only ASCII letters folded, so when ignoring case only the parts of
+					# a literal which are folded the same way can be used
+					for part in (unfolded.split(literal) if ignore_case else (literal,)):
+						part = part.lower()
+						trigrams.update((part[index] << 16) | (part[index + 1] << 8) | part[index + 2] for index in range(len(part) - 2))
+				if not trigrams:
+					conjunctions = None
+					break
+				conjunctions.append(trigrams)
+		candidates = None if conjunctions is None else self._candidates(conjunctions)
+		for file_id, path, size, mtime in self._execute('SELECT id, path, size, mtime FROM files ORDER BY path'):
+			try:
+				file_stat = os.stat(path)
+			except OSError:
+				continue
+			if file_stat.st_size != size or file_stat.st_mtime_ns != mtime:
+				# the file has changed since it was indexed so it must be searched in its entirety
+				for result in _grep_file(pattern, path, encoding=encoding):
+					yield result
+				continue
+			if candidates is not None and file_id not in candidates:
+				continue
+			blocks = dict((row[0], row[1:]) for row in self._execute('SELECT block, offset, length, line_no FROM blocks WHERE file_id = ?', (file_id,)))
+			block_numbers = sorted(blocks if candidates is None else candidates[file_id])
+			try:
+				with _grep_open(path) as file_h:
+					for block in block_numbers:
+						offset, length, line_no = blocks[block]
+						file_h.seek(offset)
+						data = file_h.read(length)
+						for block_line_no, start, end, _ in _grep_iter_buffer(pattern, data, False, None, 0, 0):
+							yield (path, line_no + block_line_no - 1, data[start:end].decode(encoding, 'replace'))
+			except _READ_ERRORS:
+				continue
+
+	def update(self, files, prune=True):
+		"""
+		Update the index with the specified files. Files which have not
+		changed since they were last indexed are skipped.
+
+		:param files: The files to index, either a path to a directory to walk
+			or an iterable such as a :py:class:`.FileWalker` yielding paths or
+			:py:class:`os.DirEntry` objects.
+		:type files: str, :py:class:`.FileWalker`
+		:param bool prune: Whether to remove previously indexed files which
+			are not included in *files*.
+		:return: The number of files which were indexed.
+		:rtype: int
+		"""
+		if isinstance(files, str):
+			files = FileWalker(files, skip_dirs=True, yield_entries=True)
+		indexed = dict((path, (size, mtime)) for path, size, mtime in self._execute('SELECT path, size, mtime FROM files'))
+		seen = set()
+		count = 0
+		for file in files:
+			path = os.path.abspath(getattr(file, 'path', file))
+			try:
+				file_stat = file.stat() if hasattr(file, 'stat') else os.stat(path)
+			except OSError:
+				continue
+			if not stat.S_ISREG(file_stat.st_mode) or path in seen:
+				continue
+			seen.add(path)
+			if indexed.get(path) == (file_stat.st_size, file_stat.st_mtime_ns):
+				continue
+			with self._lock:
+				connection = self._connect()
+				connection.execute('BEGIN')
+				try:
+					self._remove(connection, path)
+					self._index_file(connection, path, file_stat)
+				except Exception:
+					connection.execute('ROLLBACK')
+					raise
+				connection.execute('COMMIT')
+			count += 1
+		if prune:
+			with self._lock:
+				connection = self._connect()
+				connection.execute('BEGIN')
+				try:
+					for path in indexed.keys() - seen:
+						self._remove(connection, path)
+				except Exception:
+					connection.execute('ROLLBACK')
+					raise
+				connection.execute('COMMIT')
+		return count
+
+def _regex_literals(expression, flags=0):
+	# a heuristic for the literal strings which every match of a regular expression must
+	# contain, returned as a list with a single conjunction, None means none could be found
+	if isinstance(expression, (str, bytes)):
+		expression = re.compile(expression, flags)
+	if (expression.flags | flags) & re.VERBOSE:
+		return None
+	pattern = expression.pattern
+	if isinstance(pattern, bytes):
+		pattern = pattern.decode('latin-1')
+	literals = []
+	current = []
+	def end_literal():
+		if current:
+			literals.append(''.join(current))
+			del current[:]
+	index = 0
+	while index < len(pattern):
+		character = pattern[index]
+		index += 1
+		if character == '\\':
+			escaped = pattern[index:index + 1]
+			index += 1
+			if escaped and not escaped.isalnum():
+				current.append(escaped)
+				continue
+			end_literal()
+			if escaped in ('x', 'u', 'U'):
+				index += {'x': 2, 'u': 4, 'U': 8}[escaped]
+			elif escaped == 'N':
+				index = pattern.find('}', index) + 1 or len(pattern)
+			elif escaped.isdigit():
+				while pattern[index:index + 1].isdigit():
+					index += 1
+		elif character == '[':
+			end_literal()
+			if pattern[index:index + 1] == '^':
+				index += 1
+			if pattern[index:index + 1] == ']':
+				index += 1
+			while index < len(pattern) and pattern[index] != ']':
+				index += 2 if pattern[index] == '\\' else 1
+			index += 1
+		elif character == '(':
+			end_literal()
+			depth = 1
+			while index < len(pattern) and depth:
+				if pattern[index] == '\\':
+					index += 1
+				elif pattern[index] == '(':
+					depth += 1
+				elif pattern[index] == ')':
+					depth -= 1
+				index += 1
+		elif character == '|':
+			return None
+		elif character in '*?{':
+			# the previous character is optional
+			if current and (character != '{' or re.match(r'0*[,}]', pattern[index:])):
+				current.pop()
+			end_literal()
+			if character == '{':
+				index = pattern.find('}', index) + 1 or len(pattern)
+		elif character in '+.^$':
+			end_literal()
+		else:
+			current.append(character)
+	end_literal()
+	if isinstance(expression.pattern, bytes):
+		literals = [literal.encode('latin-1') for literal in literals]
+	return [literals]
+
 def configure_stream_logger(logger='', level=None, formatter='%(levelname)-8s %(message)s'):
 	"""
 	Configure the default stream handler for logging messages to the console,
@@ -469,6 +2725,98 @@ def escape_single_quote(unescaped):
 	# requirements = re
 	return re.sub(r'(\'|\\)', r'\\\1', unescaped)
 
+def find_duplicates(files, workers=4, sample_size=16384, hash_name='sha256', min_size=1):
+	"""
+	Find files with identical contents. Files are first grouped by size, then
+	by a hash of a sample from the start and end of each file and finally by
+	a hash of the complete contents, which is only calculated for files that
+	still have potential duplicates. Hashes are calculated concurrently by a
+	pool of threads. Files which are hard links to the same inode are only
+	included once and symbolic links are skipped. Since a size group is only complete once every file has
+	been seen, the path of each candidate file and the inode of each hard
+	linked file are held in memory before the first group is yielded.
+	Afterwards groups are yielded as they are confirmed.
+
+	.. versionadded:: 2.1.0
+
+	:param files: The files to check, either a path to a directory to walk
+		or an iterable such as a :py:class:`.FileWalker` yielding paths or
+		:py:class:`os.DirEntry` objects.
+	:type files: str, :py:class:`.FileWalker`
+	:param int workers: The number of threads to use for hashing.
+	:param int sample_size: The number of bytes to sample from both the start
+		and end of each file.
+	:param str hash_name: The name of the :py:mod:`hashlib` algorithm to use.
+	:param int min_size: The minimum size of files to consider.
+	:return: A generator yielding a sorted list of paths for each group of
+		duplicates.
+	"""
+	if isinstance(files, str):
+		files = FileWalker(files, skip_dirs=True, yield_entries=True)
+	sizes = collections.defaultdict(list)
+	inodes = set()
+	for file in files:
+		try:
+			# symbolic links are not followed so they are never reported as a duplicate of their target
+			file_stat = file.stat(follow_symlinks=False) if hasattr(file, 'stat') else os.lstat(file)
+		except OSError:
+			continue
+		if not stat.S_ISREG(file_stat.st_mode) or file_stat.st_size < min_size:
+			continue
+		if file_stat.st_nlink > 1:
+			inode = (file_stat.st_dev, file_stat.st_ino)
+			if inode in inodes:
+				continue
+			inodes.add(inode)
+		sizes[file_stat.st_size].append(getattr(file, 'path', file))
+	del inodes
+
+	local = threading.local()
+	def hash_file(path, size, sample):
+		buffer = getattr(local, 'buffer', None)
+		if buffer is None:
+			buffer = local.buffer = bytearray(1 << 20)
+		view = memoryview(buffer)
+		hash_obj = hashlib.new(hash_name)
+		try:
+			with open(path, 'rb') as file_h:
+				if sample and size > sample_size * 2:
+					hash_obj.update(view[:file_h.readinto(view[:sample_size])])
+					file_h.seek(-sample_size, os.SEEK_END)
+					hash_obj.update(view[:file_h.readinto(view[:sample_size])])
+				else:
+					while True:
+						read_size = file_h.readinto(view)
+						if not read_size:
+							break
+						hash_obj.update(view[:read_size])
+		except OSError:
+			return None
+		return hash_obj.digest()
+
+	def group_by_hash(executor, paths, size, sample):
+		groups = collections.defaultdict(list)
+		for path, digest in zip(paths, executor.map(functools.partial(hash_file, size=size, sample=sample), paths)):
+			if digest is not None:
+				groups[digest].append(path)
+		return [group for group in groups.values() if len(group) > 1]
+
+	executor = concurrent.futures.ThreadPoolExecutor(workers)
+	try:
+		for size in sorted(sizes, reverse=True):
+			paths = sizes.pop(size)
+			if len(paths) < 2:
+				continue
+			for group in group_by_hash(executor, paths, size, True):
+				if size > sample_size * 2:
+					# the sample did not cover the entire file so the complete contents must be compared
+					for full_group in group_by_hash(executor, group, size, False):
+						yield sorted(full_group)
+				else:
+					yield sorted(group)
+	finally:
+		executor.shutdown(wait=True)
+
 def format_bytes_size(val):
 	"""
 	Take a number of bytes and convert it to a human readable number.
@@ -485,26 +2833,462 @@ def format_bytes_size(val):
 		val /= 1024.0
 	raise OverflowError()
 
-def grep(expression, file, flags=0, invert=False):
+def _grep_buffer(pattern, buffer, invert=False):
+	# yield the (start, end) offsets of each run of consecutive selected lines
+	# in a bytes-like buffer, the end offset includes the line terminator
+	search = pattern.search
+	find = buffer.find
+	size = len(buffer)
+	position = 0
+	span_start = span_end = 0
+	while position < size:
+		match = search(buffer, position)
+		if match is None:
+			break
+		match_start = match.start()
+		line_start = buffer.rfind(b'\n', position, match_start) + 1 or position
+		line_end = find(b'\n', match_start) + 1 or size
+		if match.end() > line_end and not _grep_search_line(pattern, buffer, line_start, line_end):
+			# the match spans multiple lines so check the line on its own
+			match = None
+		if invert:
+			start, end = position, (line_start if match else line_end)
+		elif match:
+			start, end = line_start, line_end
+		else:
+			start = end = line_end
+		if start != end:
+			if start != span_end:
+				if span_start != span_end:
+					yield (span_start, span_end)
+				span_start = start
+			span_end = end
+		position = line_end
+	if invert and position < size:
+		if position != span_end:
+			if span_start != span_end:
+				yield (span_start, span_end)
+			span_start = position
+		span_end = size
+	if span_start != span_end:
+		yield (span_start, span_end)
+
+def _grep_compile(expression, flags=0, encoding=None):
+	# when encoding is specified, the returned pattern is searched for in bytes
+	matcher = None
+	if isinstance(expression, MultiPatternMatcher):
+		matcher = expression
+		expression = expression.regex
+	if isinstance(expression, (str, bytes)):
+		expression = re.compile(expression, flags)
+	elif flags & ~expression.flags:
+		expression = re.compile(expression.pattern, expression.flags | flags)
+	if encoding is None or isinstance(expression.pattern, bytes):
+		return expression
+	if _grep_pattern_is_ascii(expression.pattern):
+		return re.compile(expression.pattern.encode(encoding), expression.flags & ~re.UNICODE)
+	return _GrepTextPattern(expression, _grep_prefilter(matcher or expression, encoding), encoding)
+
+def _grep_count_lines(buffer, start, end):
+	# count in chunks to avoid copying large parts of the buffer
+	count = 0
+	for chunk_start in range(start, end, 1 << 20):
+		count += buffer[chunk_start:min(chunk_start + (1 << 20), end)].count(b'\n')
+	return count
+
+def _grep_compressions():
+	# the signature, open function and file type of each supported compression format
+	compressions = [(b'\x1f\x8b', gzip.open, gzip.GzipFile), (b'BZh', bz2.open, bz2.BZ2File)]
+	if has_lzma:
+		compressions.append((b'\xfd7zXZ\x00', lzma.open, lzma.LZMAFile))
+	return compressions
+
+def _grep_file(pattern, path, invert=False, max_count=None, encoding='utf-8'):
+	results = []
+	try:
+		file_h = _grep_open(path)
+	except OSError:
+		return results
+	try:
+		with file_h:
+			# files with a null byte in the first block are treated as binary and skipped
+			if b'\0' in file_h.read(8192):
+				return results
+			file_h.seek(0)
+			for result in _grep_iter(pattern, file_h, invert, max_count, 0, 0, True, encoding):
+				results.append((path, result.line_no, result.line))
+	except _READ_ERRORS + (ValueError,) as error:
+		# the results found before the error, such as in a truncated compressed file, are kept
+		logging.getLogger('smoke_zephyr.utilities').warning("failed to search {0} after {1} results ({2})".format(path, len(results), error))
+	return results
+
+def _grep_iter(pattern, file_h, invert, max_count, before, after, memory_map, encoding):
+	if isinstance(file_h, tuple(file_type for _, _, file_type in _grep_compressions())):
+		# the file descriptor of a decompressing file refers to the compressed data
+		memory_map = False
+	if memory_map:
+		try:
+			fileno = file_h.fileno()
+		except (AttributeError, io.UnsupportedOperation):
+			memory_map = False
+	if not memory_map:
+		if before or after:
+			results = _grep_iter_lines(pattern, file_h, invert, max_count, before, after)
+		else:
+			results = _grep_iter_chunks(pattern, file_h, invert, max_count)
+		for line_no, offset, line, context in results:
+			yield _GrepLine(line_no, offset, line.decode(encoding, 'replace'), context)
+		return
+	if not os.fstat(fileno).st_size:
+		return
+	with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as buffer:
+		results = _grep_iter_buffer(pattern, buffer, invert, max_count, before, after)
+		for line_no, start, end, context in results:
+			yield _GrepLine(line_no, start, buffer[start:end].decode(encoding, 'replace'), context)
+
+def _grep_iter_buffer(pattern, buffer, invert, max_count, before, after):
+	# yield (line_no, start, end, context) for each selected and context line
+	# of a bytes-like buffer using the offsets found by _grep_buffer
+	size = len(buffer)
+	line_no = 1
+	last_end = 0
+	after_remaining = 0
+	count = 0
+	for span_start, span_end in _grep_buffer(pattern, buffer, invert=invert):
+		start = span_start
+		while start < span_end:
+			end = buffer.find(b'\n', start, span_end) + 1 or span_end
+			while after_remaining and last_end < start:
+				context_end = buffer.find(b'\n', last_end, start) + 1 or start
+				yield (line_no, last_end, context_end, True)
+				line_no += 1
+				last_end = context_end
+				after_remaining -= 1
+			line_no += _grep_count_lines(buffer, last_end, start)
+			context = []
+			context_start = start
+			while len(context) < before and context_start > last_end:
+				previous_start = buffer.rfind(b'\n', last_end, context_start - 1) + 1 or last_end
+				context.append((previous_start, context_start))
+				context_start = previous_start
+			for index, (context_start, context_end) in enumerate(reversed(context)):
+				yield (line_no - len(context) + index, context_start, context_end, True)
+			yield (line_no, start, end, False)
+			line_no += 1
+			last_end = start = end
+			after_remaining = after
+			count += 1
+			if max_count is not None and count >= max_count:
+				break
+		else:
+			continue
+		break
+	while after_remaining and last_end < size:
+		context_end = buffer.find(b'\n', last_end) + 1 or size
+		yield (line_no, last_end, context_end, True)
+		line_no += 1
+		last_end = context_end
+		after_remaining -= 1
+
+def _grep_iter_chunks(pattern, file_h, invert, max_count, chunk_size=(1 << 22)):
+	# yield (line_no, offset, line, context) for each selected line read from a
+	# stream in large chunks which are split on line boundaries and searched
+	# using the offsets found by _grep_buffer
+	line_no = 1
+	offset = 0
+	count = 0
+	pending = []
+	while max_count is None or count < max_count:
+		chunk, error = _grep_read(file_h, chunk_size)
+		if chunk and error is None:
+			chunk_end = chunk.rfind(b'\n') + 1
+			if not chunk_end:
+				# the parts of a line longer than a chunk are only joined once its end has been read
+				pending.append(chunk)
+				continue
+			pending.append(chunk[:chunk_end])
+			buffer = b''.join(pending)
+			pending = [chunk[chunk_end:]] if chunk_end < len(chunk) else []
+		else:
+			# the data read before an error is searched before it is raised
+			pending.append(chunk)
+			buffer = b''.join(pending)
+			pending = []
+		results = _grep_iter_buffer(pattern, buffer, invert, None if max_count is None else max_count - count, 0, 0)
+		for buffer_line_no, start, end, _ in results:
+			yield (line_no + buffer_line_no - 1, offset + start, buffer[start:end], False)
+			count += 1
+		if error is not None:
+			raise error
+		if not chunk:
+			break
+		line_no += buffer.count(b'\n')
+		offset += len(buffer)
+
+def _grep_open(path):
+	# open a file for searching in binary mode, decompressing it if necessary
+	with open(path, 'rb') as file_h:
+		signature = file_h.read(6)
+	for compression_signature, compression_open, _ in _grep_compressions():
+		if signature.startswith(compression_signature):
+			return compression_open(path, 'rb')
+	return open(path, 'rb')
+
+def _grep_iter_lines(pattern, lines, invert, max_count, before, after):
+	# yield (line_no, offset, line, context) for each selected and context
+	# line from an iterable of bytes lines, holding at most before lines
+	context = collections.deque(maxlen=before)
+	after_remaining = 0
+	count = 0
+	offset = 0
+	for line_no, line in enumerate(lines, 1):
+		if max_count is not None and count >= max_count:
+			if not after_remaining:
+				break
+			yield (line_no, offset, line, True)
+			after_remaining -= 1
+		elif _grep_search_line(pattern, line, 0, len(line)) ^ invert:
+			while context:
+				yield context.popleft()
+			yield (line_no, offset, line, False)
+			after_remaining = after
+			count += 1
+		elif after_remaining:
+			yield (line_no, offset, line, True)
+			after_remaining -= 1
+		elif before:
+			context.append((line_no, offset, line, True))
+		offset += len(line)
+
+def _grep_mmap(pattern, file_h, invert, encoding):
+	if not os.fstat(file_h.fileno()).st_size:
+		return []
+	lines = []
+	with mmap.mmap(file_h.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+		# each run of consecutive lines is decoded at once
+		for start, end in _grep_buffer(pattern, buffer, invert=invert):
+			span = buffer[start:end].decode(encoding, 'replace').split('\n')
+			last = span.pop()
+			lines.extend(line + '\n' for line in span)
+			if last:
+				lines.append(last)
+	return lines
+
+def _grep_pattern_is_ascii(pattern):
+	# whether a str pattern only refers to ASCII characters, including through escapes, so it matches the same
+	# characters once encoded (with the exception of character classes and case folding)
+	if any(ord(character) > 0x7f for character in pattern):
+		return False
+	for match in re.finditer(r'\\(?:x([0-9a-fA-F]{2})|(0[0-7]{0,2}|[0-3][0-7]{2})|([uUN])|.)', pattern, re.DOTALL):
+		if match.group(3) or (match.group(1) and int(match.group(1), 16) > 0x7f) or (match.group(2) and int(match.group(2), 8) > 0x7f):
+			return False
+	return True
+
+def _grep_prefilter(expression, encoding):
+	# a bytes pattern which matches within every line that a str expression can match, None means none could be
+	# determined, only the literals which are found the same way when encoded are used
+	if isinstance(expression, MultiPatternMatcher):
+		ignore_case = expression.ignore_case
+	else:
+		ignore_case = bool(expression.flags & re.IGNORECASE)
+	if ignore_case:
+		# bytes patterns only fold ASCII letters and these also fold to non-ASCII characters such as the kelvin sign
+		unsafe = re.compile('[^\x00-\x7f]|[iksIKS]')
+	else:
+		# lines are decoded with invalid bytes being replaced
+		unsafe = re.compile('\ufffd')
+	try:
+		if isinstance(expression, MultiPatternMatcher):
+			if any(unsafe.search(pattern) for pattern in expression.patterns):
+				return None
+			return MultiPatternMatcher([pattern.encode(encoding) for pattern in expression.patterns], ignore_case=ignore_case).regex
+		literals = _regex_literals(expression)
+		if literals is None:
+			return None
+		# every literal must be contained in a match so the longest part of one is sufficient
+		literal = max((part for literal in literals[0] for part in unsafe.split(literal)), key=len, default='')
+		if not literal:
+			return None
+		return re.compile(re.escape(literal.encode(encoding)), re.IGNORECASE if ignore_case else 0)
+	except UnicodeError:
+		return None
+
+def _grep_read(file_h, size):
+	# read up to size bytes in smaller parts so only the last part is lost if an error occurs
+	parts = []
+	length = 0
+	try:
+		while length < size:
+			part = file_h.read(min(size - length, 1 << 16))
+			if not part:
+				break
+			parts.append(part)
+			length += len(part)
+	except _READ_ERRORS as error:
+		return b''.join(parts), error
+	return b''.join(parts), None
+
+def _grep_search_line(pattern, data, start, end):
+	# the line terminator is searched like it is in text mode, however an
+	# empty match after it (such as with ^) belongs to the following line
+	match = pattern.search(data, start, end)
+	return match is not None and (match.start() < end or data[end - 1:end] != b'\n')
+
+def grep(expression, file, flags=0, invert=False, memory_map=False, encoding='utf-8'):
 	"""
 	Search a file and return a list of all lines that match a regular expression.
 
-	:param str expression: The regex to search for.
+	When *memory_map* is enabled, the file is memory-mapped and searched as
+	bytes with a single compiled pattern (with :py:data:`re.MULTILINE` set)
+	instead of line by line, which is significantly faster for large files
+	where matching lines are sparse. Only the selected lines are decoded
+	using *encoding*, and since the file is not opened in text mode, line endings
+	are returned as they are stored. In this mode, an *expression* which only
+	refers to ASCII characters is encoded with *encoding*, so character
+	classes such as ``\\w`` and ``.`` only match single ASCII characters or
+	bytes and case-insensitive matching only folds ASCII letters. Other
+	expressions are searched for a literal which every match must contain
+	(if one can be determined) and the candidate lines are decoded and
+	searched with *expression* itself. Since the file is searched as a
+	whole, ``\\A`` only matches at the start of the file and lookbehind
+	assertions can match the end of the previous line.
+
+	When *file* is a path to a file compressed with gzip, bzip2 or xz (if
+	:py:data:`.has_lzma` is True) it is transparently decompressed while
+	being searched.
+
+	.. versionchanged:: 2.1.0
+		Added the *memory_map* and *encoding* parameters. Files which are
+		opened by this function are now closed and compressed files are
+		supported.
+
+	:param expression: The regex to search for.
+	:type expression: str, bytes, :py:class:`re.Pattern`
 	:param file: The file to search in.
 	:type file: str, file
 	:param int flags: The regex flags to use when searching.
 	:param bool invert: Select non matching lines instead.
+	:param bool memory_map: Search the memory-mapped file as bytes.
+	:param str encoding: The encoding to use for decoding lines in
+		memory-mapped mode, invalid bytes are replaced like they are by
+		:py:func:`.grep_iter` and :py:func:`.grep_files`.
 	:return: All the matching lines.
 	:rtype: list
 	"""
 	# requirements = re
+	if memory_map:
+		pattern = _grep_compile(expression, flags | re.MULTILINE, encoding=encoding)
+		if isinstance(file, str):
+			with _grep_open(file) as file_h:
+				if isinstance(file_h, io.BufferedReader):
+					return _grep_mmap(pattern, file_h, invert, encoding)
+				return [result.line for result in _grep_iter(pattern, file_h, invert, None, 0, 0, False, encoding)]
+		return _grep_mmap(pattern, file, invert, encoding)
+	pattern = _grep_compile(expression, flags)
 	if isinstance(file, str):
-		file = open(file)
-	lines = []
-	for line in file:
-		if bool(re.search(expression, line, flags=flags)) ^ invert:
-			lines.append(line)
-	return lines
+		with io.TextIOWrapper(_grep_open(file)) as file_h:
+			return [line for line in file_h if bool(pattern.search(line)) ^ invert]
+	return [line for line in file if bool(pattern.search(line)) ^ invert]
+
+def grep_files(expression, paths_or_walker, workers=4, flags=0, invert=False, max_count=None, encoding='utf-8', ordered=True):
+	"""
+	Search multiple files concurrently for lines that match a regular
+	expression. Each file is searched using the memory-mapped fast path of
+	:py:func:`.grep` by a pool of threads with at most a fixed number of files
+	pending at a time, so results are streamed while the remaining files are
+	being searched. Files which contain a null byte in their first block are
+	considered binary and are skipped as are files which can not be opened.
+	Compressed files are decompressed as they are searched as described in
+	:py:func:`.grep`. If an error occurs while reading a file, such as when a
+	compressed file is truncated, the results found before it are yielded and
+	a warning is logged. Lines are decoded using *encoding* with invalid bytes
+	being replaced.
+
+	.. versionadded:: 2.1.0
+
+	:param expression: The regex to search for.
+	:type expression: str, bytes, :py:class:`re.Pattern`
+	:param paths_or_walker: The files to search, either a path to a directory
+		to walk or an iterable such as a :py:class:`.FileWalker` yielding paths
+		or :py:class:`os.DirEntry` objects.
+	:type paths_or_walker: str, :py:class:`.FileWalker`
+	:param int workers: The number of threads to use for searching.
+	:param int flags: The regex flags to use when searching.
+	:param bool invert: Select non matching lines instead.
+	:param int max_count: The maximum number of lines to select from each file.
+	:param str encoding: The encoding to use for decoding lines.
+	:param bool ordered: Whether to yield results in the order that the files
+		were specified in or as soon as each file has been searched.
+	:return: A generator yielding a tuple of the path, line number and line
+		for each selected line.
+	"""
+	if isinstance(paths_or_walker, str):
+		paths_or_walker = FileWalker(paths_or_walker, skip_dirs=True)
+	pattern = _grep_compile(expression, flags | re.MULTILINE, encoding=encoding)
+	search_file = functools.partial(_grep_file, pattern, invert=invert, max_count=max_count, encoding=encoding)
+	paths = (getattr(path, 'path', path) for path in paths_or_walker)
+	pending_limit = workers * 4
+	executor = concurrent.futures.ThreadPoolExecutor(workers)
+	pending = collections.deque()
+	try:
+		while True:
+			for path in itertools.islice(paths, pending_limit - len(pending)):
+				pending.append(executor.submit(search_file, path))
+			if not pending:
+				break
+			if ordered:
+				done = (pending.popleft(),)
+			else:
+				done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+				for future in done:
+					pending.remove(future)
+			for future in done:
+				for result in future.result():
+					yield result
+	finally:
+		for future in pending:
+			future.cancel()
+		executor.shutdown(wait=True)
+
+def grep_iter(expression, file, flags=0, invert=False, max_count=None, before=0, after=0, memory_map=True, encoding='utf-8'):
+	"""
+	Search a file for lines that match a regular expression, yielding each
+	one as it is found. Unlike :py:func:`.grep`, the file is always searched
+	as bytes and only the lines which are yielded are decoded using
+	*encoding* with invalid bytes being replaced. Context lines surrounding
+	the selected lines can be included by specifying *before* and *after*,
+	these are yielded once each and in order with the selected lines and
+	have their ``context`` attribute set to True. Memory usage is
+	independent of the number of lines selected. When *file* is a path to a
+	compressed file, it is decompressed as described in :py:func:`.grep`
+	and offsets refer to the decompressed data.
+
+	.. versionadded:: 2.1.0
+
+	:param expression: The regex to search for.
+	:type expression: str, bytes, :py:class:`re.Pattern`
+	:param file: The file to search in, either a path or a file opened in binary mode.
+	:type file: str, file
+	:param int flags: The regex flags to use when searching.
+	:param bool invert: Select non matching lines instead.
+	:param int max_count: The maximum number of lines to select before stopping.
+	:param int before: The number of context lines to include before each selected line.
+	:param int after: The number of context lines to include after each selected line.
+	:param bool memory_map: Search the memory-mapped file instead of reading
+		it in chunks (or line by line when context lines are included), this
+		is ignored for compressed files and file objects which can not be
+		memory-mapped.
+	:param str encoding: The encoding to use for decoding lines.
+	:return: A generator yielding a named tuple of the line number, the byte
+		offset of the start of the line, the line and whether or not it is a
+		context line.
+	"""
+	pattern = _grep_compile(expression, flags | re.MULTILINE, encoding=encoding)
+	if isinstance(file, str):
+		with _grep_open(file) as file_h:
+			yield from _grep_iter(pattern, file_h, invert, max_count, before, after, memory_map, encoding)
+	else:
+		yield from _grep_iter(pattern, file, invert, max_count, before, after, memory_map, encoding)
 
 def is_valid_email_address(email_address):
 	"""
@@ -35,7 +35,13 @@ import logging
 from .argparse_types import ArgparseTypeTests
 from .job import JobManagerTests
 from .utilities import UtilitiesTests
+from .utilities import UtilitiesBruteforceGeneratorTests
 from .utilities import UtilitiesCacheTests
+from .utilities import UtilitiesFileWalkerTests
+from .utilities import UtilitiesGrepTests
+from .utilities import UtilitiesHybridGeneratorTests
+from .utilities import UtilitiesMultiPatternMatcherTests
+from .utilities import UtilitiesTrigramIndexTests
 
 if hasattr(logging, 'NullHandler'):
 	logging.getLogger('').addHandler(logging.NullHandler())
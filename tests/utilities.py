@@ -30,7 +30,21 @@
 #  OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 
+import asyncio
+import bz2
 import collections
+import gzip
+import io
+import itertools
+import json
+import os
+import pickle
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
 
 from smoke_zephyr import utilities
@@ -41,6 +55,585 @@ SINGLE_QUOTE_STRING_UNESCAPED = """C:\\Users\\Alice\\Desktop\\Alice's Secret Fil
 def cache_test(first_name, last_name, email=None, dob=None):
 	return utilities.random_string_alphanumeric(24)
 
+def cache_test_alternate(first_name, last_name, email=None, dob=None):
+	return utilities.random_string_alphanumeric(24)
+
+def bruteforce_test(candidate):
+	if candidate.startswith('b'):
+		return candidate.upper()
+	return None
+
+class UtilitiesBruteforceGeneratorTests(utilities.TestCase):
+	def test_bruteforce_generator(self):
+		generator = utilities.BruteforceGenerator(1, 3, 'cba')
+		self.assertEqual(generator.charset, ('a', 'b', 'c'))
+		candidates = list(generator)
+		self.assertEqual(candidates[:4], ['a', 'b', 'c', 'aa'])
+		self.assertEqual(candidates[-1], 'ccc')
+		self.assertEqual(len(candidates), 3 + 9 + 27)
+		self.assertEqual(generator.length, 3)
+
+	def test_bruteforce_generator_bytes(self):
+		candidates = [candidate.encode('latin-1') for candidate in utilities.BruteforceGenerator(1, 3, 'abc\xff')]
+		generator = utilities.BruteforceGenerator(1, 3, 'abc\xff', as_bytes=True)
+		self.assertEqual(generator[5], candidates[5])
+		self.assertEqual(list(generator), candidates)
+		with self.assertRaises(ValueError):
+			utilities.BruteforceGenerator(1, 3, 'abc\u0100', as_bytes=True)
+
+	def test_bruteforce_generator_mask(self):
+		generator = utilities.BruteforceGenerator.from_mask('?u-?d?1', charsets={1: 'xy?d'})
+		self.assertEqual(len(generator), 26 * 10 * 12)
+		self.assertEqual(generator[0], 'A-00')
+		self.assertEqual(generator[-1], 'Z-9y')
+		candidates = list(generator)
+		self.assertEqual(len(candidates), len(generator))
+		self.assertTrue(all(re.match(r'^[A-Z]-[0-9][0-9xy]$', candidate) for candidate in candidates))
+		generator.seek(1000)
+		self.assertEqual(next(generator), candidates[1000])
+
+		generator = utilities.BruteforceGenerator.from_mask('?d??', increment=True)
+		self.assertEqual(list(generator)[:11], [str(digit) for digit in range(10)] + ['0?'])
+		self.assertEqual(len(generator), 20)
+
+		with self.assertRaises(ValueError):
+			utilities.BruteforceGenerator.from_mask('?d?')
+		with self.assertRaises(ValueError):
+			utilities.BruteforceGenerator.from_mask('?d?9')
+
+	@unittest.skipUnless(utilities.has_numpy, 'this test requires numpy')
+	def test_bruteforce_generator_next_block(self):
+		candidates = list(utilities.BruteforceGenerator.from_mask('?d?l', increment=True, as_bytes=True))
+		generator = utilities.BruteforceGenerator.from_mask('?d?l', increment=True)
+		generated = []
+		while True:
+			block = generator.next_block(64)
+			if not len(block):
+				break
+			self.assertLessEqual(len(block), 64)
+			generated.extend(row.tobytes() for row in block)
+		self.assertEqual(generated, candidates)
+
+	def test_bruteforce_generator_next_into(self):
+		candidates = [candidate.encode('latin-1') for candidate in utilities.BruteforceGenerator(1, 3, 'abc')]
+		generator = utilities.BruteforceGenerator(1, 3, 'abc', as_bytes=True)
+		buffer = bytearray(16)
+		generated = []
+		while True:
+			count, length = generator.next_into(buffer)
+			if not count:
+				break
+			self.assertLessEqual(count * length, len(buffer))
+			generated.extend(bytes(buffer[idx:idx + length]) for idx in range(0, count * length, length))
+		self.assertEqual(generated, candidates)
+
+	def test_bruteforce_generator_checkpoint(self):
+		candidates = list(utilities.BruteforceGenerator(1, 3, 'abc'))
+		checkpoints = []
+		generator = utilities.BruteforceGenerator(1, 3, 'abc')
+		generator.set_checkpoint(checkpoints.append, 10)
+		generated = [next(generator) for _ in range(25)]
+		self.assertEqual([checkpoint['index'] for checkpoint in checkpoints], [10, 20])
+
+		# a restart resumes after the last candidate which was consumed before the checkpoint
+		generator = utilities.BruteforceGenerator.from_state(json.loads(json.dumps(checkpoints[-1])))
+		self.assertEqual(generated[:20] + list(generator), candidates)
+
+	def test_bruteforce_generator_state(self):
+		generator = utilities.BruteforceGenerator.from_mask('?d?l', increment=True, as_bytes=True).shard(1, 3)
+		candidates = list(generator.shard(0, 1))
+		next(generator)
+		restored = utilities.BruteforceGenerator.from_state(generator.state())
+		self.assertEqual(restored.mask, '?d?l')
+		self.assertEqual(len(restored), len(generator))
+		self.assertEqual(list(restored), candidates[1:])
+
+	def test_bruteforce_generator_indexing(self):
+		generator = utilities.BruteforceGenerator(1, 3, 'cba')
+		candidates = list(utilities.BruteforceGenerator(1, 3, 'cba'))
+		self.assertEqual(len(generator), len(candidates))
+		for index, candidate in enumerate(candidates):
+			self.assertEqual(generator[index], candidate)
+		self.assertEqual(generator[-1], candidates[-1])
+		with self.assertRaises(IndexError):
+			generator[len(candidates)]
+
+	def test_bruteforce_generator_seek(self):
+		candidates = list(utilities.BruteforceGenerator(0, 3, 'abc'))
+		self.assertEqual(candidates[0], '')
+		generator = utilities.BruteforceGenerator(0, 3, 'abc')
+		for index in range(len(candidates) + 1):
+			generator.seek(index)
+			self.assertEqual(generator.tell(), index)
+			self.assertEqual(list(generator), candidates[index:])
+
+	def test_bruteforce_generator_shard(self):
+		candidates = list(utilities.BruteforceGenerator(1, 3, 'abc'))
+		shards = utilities.BruteforceGenerator(1, 3, 'abc').partition(4)
+		self.assertEqual(sum(len(shard) for shard in shards), len(candidates))
+		self.assertEqual(list(itertools.chain.from_iterable(shards)), candidates)
+
+		shard = utilities.BruteforceGenerator(1, 3, 'abc').shard(1, 4)
+		self.assertEqual(shard[0], candidates[len(candidates) // 4])
+		shard.seek(2)
+		self.assertEqual(next(shard), candidates[len(candidates) // 4 + 2])
+
+		shard = utilities.BruteforceGenerator(1, 3, 'ab').shard(1, 2)
+		self.assertEqual(shard.length, 3)
+		self.assertEqual(len(next(shard)), shard.length)
+		shard = utilities.BruteforceGenerator(1, 3, 'ab').shard(0, 2)
+		self.assertEqual(shard.length, 1)
+		shard.seek(2)
+		self.assertEqual(len(next(shard)), shard.length)
+
+	def test_bruteforce_generator_run_parallel(self):
+		generator = utilities.BruteforceGenerator(1, 3, 'abc')
+		expected = [(candidate, bruteforce_test(candidate)) for candidate in utilities.BruteforceGenerator(1, 3, 'abc') if bruteforce_test(candidate)]
+		self.assertEqual(generator.run_parallel(bruteforce_test, processes=2), expected)
+
+class UtilitiesFileWalkerTests(utilities.TestCase):
+	def setUp(self):
+		self.tmp_directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.tmp_directory)
+		for path in ('a/b/c', 'a/d', 'e'):
+			os.makedirs(os.path.join(self.tmp_directory, path))
+		for path in ('f.txt', 'a/g.txt', 'a/b/h.log', 'a/b/c/i.txt', 'e/j.log'):
+			with open(os.path.join(self.tmp_directory, path), 'w') as file_h:
+				file_h.write(path)
+
+	def _walk(self, **kwargs):
+		return sorted(os.path.relpath(path, self.tmp_directory) for path in utilities.FileWalker(self.tmp_directory, absolute_path=True, **kwargs))
+
+	def test_file_walker(self):
+		self.assertEqual(self._walk(), ['.', 'a', 'a/b', 'a/b/c', 'a/b/c/i.txt', 'a/b/h.log', 'a/d', 'a/g.txt', 'e', 'e/j.log', 'f.txt'])
+		self.assertEqual(self._walk(skip_dirs=True), ['a/b/c/i.txt', 'a/b/h.log', 'a/g.txt', 'e/j.log', 'f.txt'])
+		self.assertEqual(self._walk(skip_files=True, max_depth=2), ['.', 'a', 'a/b', 'a/d', 'e'])
+		self.assertEqual(self._walk(filter_func=lambda path: path.endswith('.log')), ['a/b/h.log', 'e/j.log'])
+
+	def test_file_walker_patterns(self):
+		self.assertEqual(self._walk(exclude=['b/']), ['.', 'a', 'a/d', 'a/g.txt', 'e', 'e/j.log', 'f.txt'])
+		self.assertEqual(self._walk(exclude=['a/b', '*.txt']), ['.', 'a', 'a/d', 'e', 'e/j.log'])
+		self.assertEqual(self._walk(exclude=['/e', 'a/**/c']), ['.', 'a', 'a/b', 'a/b/h.log', 'a/d', 'a/g.txt', 'f.txt'])
+		self.assertEqual(self._walk(include=['*.log']), ['.', 'a/b/h.log', 'e/j.log'])
+		self.assertEqual(self._walk(include=['a/**/*.txt'], exclude=['c/']), ['.', 'a/g.txt'])
+		with self.assertRaises(ValueError):
+			utilities.FileWalker(self.tmp_directory, exclude=['*.txt', '!f.txt'])
+		with open(os.path.join(self.tmp_directory, '!k.txt'), 'w'):
+			pass
+		self.assertEqual(self._walk(include=['\\!*']), ['!k.txt', '.'])
+
+		# excluded directories must not be scanned at all
+		scanned = []
+		walker = utilities.FileWalker(self.tmp_directory, exclude=['a'])
+		original_scan = walker._scan
+		walker._scan = lambda path: scanned.append(path) or original_scan(path)
+		list(walker)
+		self.assertEqual(sorted(os.path.relpath(path, self.tmp_directory) for path in scanned), ['.', 'e'])
+
+	def test_file_walker_patterns_root(self):
+		# the root directory ends with a separator unlike other paths
+		root = os.path.abspath(os.sep)
+		names = sorted(os.listdir(root))
+		directory = next((name for name in names if os.path.isdir(os.path.join(root, name)) and not os.path.islink(os.path.join(root, name)) and os.listdir(os.path.join(root, name))), None)
+		if directory is None:
+			self.skipTest('this test requires a non-empty directory in the root directory')
+		child = sorted(os.listdir(os.path.join(root, directory)))[0]
+		others = ['/' + name for name in names if name != directory]
+		walker = utilities.FileWalker(root, absolute_path=True, max_depth=2, exclude=others)
+		self.assertIn(os.path.join(root, directory, child), list(walker))
+		walker = utilities.FileWalker(root, absolute_path=True, max_depth=2, exclude=others + [directory + '/' + child])
+		self.assertNotIn(os.path.join(root, directory, child), list(walker))
+
+	def test_file_walker_workers(self):
+		serial = list(utilities.FileWalker(self.tmp_directory))
+		self.assertEqual(list(utilities.FileWalker(self.tmp_directory, workers=4)), serial)
+		self.assertEqual(sorted(utilities.FileWalker(self.tmp_directory, workers=4, ordered=False)), sorted(serial))
+		self.assertEqual(self._walk(workers=4, ordered=False, skip_files=True, max_depth=2), ['.', 'a', 'a/b', 'a/d', 'e'])
+		self.assertEqual(self._walk(workers=4, skip_files=True, max_depth=2), ['.', 'a', 'a/b', 'a/d', 'e'])
+
+	def test_file_walker_changes(self):
+		snapshot_path = os.path.join(tempfile.mkdtemp(), 'snapshot')
+		self.addCleanup(shutil.rmtree, os.path.dirname(snapshot_path))
+		walker = utilities.FileWalker(self.tmp_directory, absolute_path=True)
+		changes = lambda: sorted((change, os.path.relpath(path, self.tmp_directory)) for change, path in walker.changes(snapshot_path))
+		self.assertEqual(changes(), sorted(('added', path) for path in self._walk() if path != '.'))
+		self.assertEqual(changes(), [])
+
+		with open(os.path.join(self.tmp_directory, 'a', 'b', 'h.log'), 'a') as file_h:
+			file_h.write('modified')
+		with open(os.path.join(self.tmp_directory, 'a', 'd', 'k.log'), 'w') as file_h:
+			file_h.write('added')
+		shutil.rmtree(os.path.join(self.tmp_directory, 'e'))
+		self.assertEqual(changes(), [('added', 'a/d/k.log'), ('modified', 'a/b/h.log'), ('removed', 'e'), ('removed', 'e/j.log')])
+		self.assertEqual(changes(), [])
+
+	def test_file_walker_find_duplicates(self):
+		def write(path, data):
+			with open(os.path.join(self.tmp_directory, path), 'wb') as file_h:
+				file_h.write(data)
+		large = os.urandom(4096)
+		write('dup1.bin', large)
+		write('a/dup2.bin', large)
+		write('a/b/dup3.bin', large)
+		write('near.bin', large[:2048] + b'\x00' + large[2049:])
+		os.link(os.path.join(self.tmp_directory, 'dup1.bin'), os.path.join(self.tmp_directory, 'e', 'link.bin'))
+		groups = list(utilities.find_duplicates(self.tmp_directory, sample_size=512))
+		groups = [sorted(os.path.relpath(path, self.tmp_directory) for path in group) for group in groups]
+		self.assertEqual(len(groups), 1)
+		self.assertEqual(groups[0][:2], ['a/b/dup3.bin', 'a/dup2.bin'])
+		self.assertEqual(len(groups[0]), 3)
+
+		# a symbolic link is not a duplicate of its target
+		write('real.bin', os.urandom(4096))
+		os.symlink('real.bin', os.path.join(self.tmp_directory, 'alias.bin'))
+		paths = [os.path.join(self.tmp_directory, name) for name in ('real.bin', 'alias.bin')]
+		self.assertEqual(list(utilities.find_duplicates(paths)), [])
+		groups = list(utilities.find_duplicates(self.tmp_directory, sample_size=512))
+		self.assertEqual(len(groups), 1)
+		self.assertEqual(len(groups[0]), 3)
+
+	def test_file_walker_disk_usage(self):
+		os.link(os.path.join(self.tmp_directory, 'f.txt'), os.path.join(self.tmp_directory, 'a', 'b', 'link.txt'))
+		walker = utilities.FileWalker(self.tmp_directory, absolute_path=True)
+		usage = dict((os.path.relpath(path, self.tmp_directory), usage) for path, usage in walker.disk_usage())
+		self.assertEqual(sorted(usage.keys()), ['.', 'a', 'a/b', 'a/b/c', 'a/d', 'e'])
+		self.assertEqual(usage['a/b/c'].files, 1)
+		self.assertEqual(usage['a/b/c'].bytes, len('a/b/c/i.txt'))
+		self.assertEqual(usage['.'].files, 5)
+		self.assertEqual(usage['.'].bytes, sum(len(path) for path in ('f.txt', 'a/g.txt', 'a/b/h.log', 'a/b/c/i.txt', 'e/j.log')))
+
+		usage = list(walker.disk_usage(max_depth=1))
+		self.assertEqual(usage[-1][0], self.tmp_directory)
+		self.assertEqual(usage[-1][1].files, 5)
+		self.assertEqual(sorted(os.path.relpath(path, self.tmp_directory) for path, _ in usage), ['.', 'a', 'e'])
+
+	def test_file_walker_async(self):
+		async def walk(walker):
+			paths = []
+			async for path in walker:
+				paths.append(path)
+			return paths
+		loop = asyncio.new_event_loop()
+		self.addCleanup(loop.close)
+		serial = list(utilities.FileWalker(self.tmp_directory))
+		self.assertEqual(sorted(loop.run_until_complete(walk(utilities.FileWalker(self.tmp_directory)))), sorted(serial))
+		walker = utilities.FileWalker(self.tmp_directory, skip_files=True, max_depth=2, workers=2)
+		self.assertEqual(sorted(loop.run_until_complete(walk(walker))), sorted(walker))
+
+	def test_file_walker_file(self):
+		path = os.path.join(self.tmp_directory, 'f.txt')
+		self.assertEqual(list(utilities.FileWalker(path, absolute_path=True)), [path])
+
+	def test_file_walker_yield_entries(self):
+		entries = list(utilities.FileWalker(self.tmp_directory, yield_entries=True, filter_func=lambda entry: entry.is_file()))
+		self.assertEqual(sorted(entry.name for entry in entries), ['f.txt', 'g.txt', 'h.log', 'i.txt', 'j.log'])
+		for entry in entries:
+			self.assertEqual(entry.stat().st_size, len(os.path.relpath(entry.path, self.tmp_directory)))
+
+class UtilitiesGrepTests(utilities.TestCase):
+	def setUp(self):
+		tmp_directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, tmp_directory)
+		self.path = os.path.join(tmp_directory, 'test.log')
+		with open(self.path, 'w') as file_h:
+			file_h.write('alice liddle\nbob\n\ncharlie smith\nalice smith')
+		self.empty_path = os.path.join(tmp_directory, 'empty.log')
+		open(self.empty_path, 'w').close()
+
+	def test_grep(self):
+		self.assertEqual(utilities.grep('alice', self.path), ['alice liddle\n', 'alice smith'])
+		self.assertEqual(utilities.grep('ALICE', self.path, flags=re.IGNORECASE), ['alice liddle\n', 'alice smith'])
+		self.assertEqual(utilities.grep('smith', self.path, invert=True), ['alice liddle\n', 'bob\n', '\n'])
+		self.assertEqual(utilities.grep(re.compile('^bob$'), self.path), ['bob\n'])
+		with open(self.path) as file_h:
+			self.assertEqual(utilities.grep('charlie', file_h), ['charlie smith\n'])
+
+	def test_grep_memory_map(self):
+		cases = (
+			('alice', 0, False),
+			('ALICE', re.IGNORECASE, False),
+			('smith', 0, True),
+			('^bob$', 0, False),
+			('^$', 0, False),
+			(r'liddle\s+bob', 0, False),
+			(r'e\s*$', 0, True),
+			('missing', 0, True),
+		)
+		for expression, flags, invert in cases:
+			self.assertEqual(
+				utilities.grep(expression, self.path, flags=flags, invert=invert, memory_map=True),
+				utilities.grep(expression, self.path, flags=flags, invert=invert),
+				msg="grep({!r}, flags={!r}, invert={!r})".format(expression, flags, invert)
+			)
+		self.assertEqual(utilities.grep(re.compile(b'bob'), self.path, memory_map=True), ['bob\n'])
+		self.assertEqual(utilities.grep(re.compile('bob'), self.path, memory_map=True), ['bob\n'])
+		self.assertEqual(utilities.grep(re.compile('BOB', re.IGNORECASE), self.path, memory_map=True), ['bob\n'])
+		with open(self.path, 'rb') as file_h:
+			self.assertEqual(utilities.grep('charlie', file_h, memory_map=True), ['charlie smith\n'])
+		self.assertEqual(utilities.grep('alice', self.empty_path, memory_map=True), [])
+		# the line terminator can be matched just like in text mode
+		with open(self.path, 'w') as file_h:
+			file_h.write('a\nb a\nc\n')
+		self.assertEqual(utilities.grep(r'a\s', self.path), ['a\n', 'b a\n'])
+		self.assertEqual(utilities.grep(r'a\s', self.path, memory_map=True), ['a\n', 'b a\n'])
+		self.assertEqual([result.line for result in utilities.grep_iter(r'a\s', self.path)], ['a\n', 'b a\n'])
+		self.assertEqual([result.line for result in utilities.grep_iter(r'a\s', self.path, memory_map=False)], ['a\n', 'b a\n'])
+
+	def test_grep_memory_map_non_ascii(self):
+		with open(self.path, 'w', encoding='utf-8') as file_h:
+			file_h.write('plain caf\xe9 line\nplain caf\xc0 line\nCAF\xc9 caf\xe9\xe9\n\xc4bcdef\nabc\n')
+		cases = (
+			('caf[\xe9\xe8]', 0),
+			('caf\xe9+', 0),
+			('caf\xe9', re.IGNORECASE),
+			('\xc4BCDEF', re.IGNORECASE),
+			('caf\\u00e9', 0),
+			('[^\xe9]\n', 0),
+		)
+		for expression, flags in cases:
+			with open(self.path, encoding='utf-8') as file_h:
+				expected = utilities.grep(expression, file_h, flags=flags)
+			self.assertTrue(expected)
+			msg = "grep({!r}, flags={!r})".format(expression, flags)
+			self.assertEqual(utilities.grep(expression, self.path, flags=flags, memory_map=True), expected, msg=msg)
+			self.assertEqual([result.line for result in utilities.grep_iter(expression, self.path, flags=flags)], expected, msg=msg)
+			self.assertEqual([result.line for result in utilities.grep_iter(expression, self.path, flags=flags, memory_map=False)], expected, msg=msg)
+			self.assertEqual([line for _, _, line in utilities.grep_files(expression, [self.path], flags=flags)], expected, msg=msg)
+		matcher = utilities.MultiPatternMatcher(['caf\xe9'], ignore_case=True)
+		self.assertEqual(utilities.grep(matcher, self.path, memory_map=True), ['plain caf\xe9 line\n', 'CAF\xc9 caf\xe9\xe9\n'])
+		# invalid bytes are replaced in every mode
+		with open(self.path, 'wb') as file_h:
+			file_h.write(b'bad \xff byte\n')
+		self.assertEqual(utilities.grep('bad', self.path, memory_map=True), ['bad \ufffd byte\n'])
+		self.assertEqual([result.line for result in utilities.grep_iter('bad', self.path)], ['bad \ufffd byte\n'])
+
+	def test_grep_compressed(self):
+		tmp_directory = os.path.dirname(self.path)
+		with open(self.path, 'rb') as file_h:
+			data = file_h.read()
+		paths = []
+		for module, extension in ((gzip, 'gz'), (bz2, 'bz2'), (utilities.lzma if utilities.has_lzma else None, 'xz')):
+			if module is None:
+				continue
+			path = os.path.join(tmp_directory, 'compressed.' + extension)
+			with module.open(path, 'wb') as file_h:
+				file_h.write(data)
+			paths.append(path)
+			self.assertEqual(utilities.grep('smith', path), ['charlie smith\n', 'alice smith'])
+			self.assertEqual(utilities.grep('smith', path, memory_map=True), ['charlie smith\n', 'alice smith'])
+			for before in (0, 1):
+				self.assertEqual(list(utilities.grep_iter('^bob', path, before=before)), list(utilities.grep_iter('^bob', self.path, before=before)))
+		results = list(utilities.grep_files('alice', paths))
+		self.assertEqual([(line_no, line) for _, line_no, line in results], [(1, 'alice liddle\n'), (5, 'alice smith')] * len(paths))
+
+		# results before the end of a truncated file are still returned
+		truncated_path = os.path.join(tmp_directory, 'truncated.gz')
+		with gzip.open(truncated_path, 'wb') as file_h:
+			file_h.write(b''.join("alice {0}\n".format(index).encode() for index in range(20000)))
+		with open(truncated_path, 'r+b') as file_h:
+			file_h.truncate(os.path.getsize(truncated_path) // 2)
+		with self.assertLogs('smoke_zephyr.utilities', level='WARNING'):
+			results = list(utilities.grep_files('alice', [truncated_path]))
+		self.assertTrue(results)
+		self.assertEqual(results[0], (truncated_path, 1, 'alice 0\n'))
+
+	def test_grep_iter_chunks(self):
+		data = b'a' * 100 + b' needle\n' + b'b' * 50 + b'\nneedle'
+		results = list(utilities._grep_iter_chunks(re.compile(b'needle'), io.BytesIO(data), False, None, chunk_size=8))
+		self.assertEqual(results, [(1, 0, b'a' * 100 + b' needle\n', False), (3, 159, b'needle', False)])
+
+	def test_grep_files(self):
+		tmp_directory = os.path.dirname(self.path)
+		with open(os.path.join(tmp_directory, 'binary.log'), 'wb') as file_h:
+			file_h.write(b'alice\0\n')
+		os.mkdir(os.path.join(tmp_directory, 'logs'))
+		other_path = os.path.join(tmp_directory, 'logs', 'other.log')
+		with open(other_path, 'w') as file_h:
+			file_h.write('bob\n' + 'alice\n' * 5)
+		paths = [self.path, self.empty_path, other_path, os.path.join(tmp_directory, 'missing.log')]
+		results = list(utilities.grep_files('alice', paths, workers=2))
+		self.assertEqual(results[:2], [(self.path, 1, 'alice liddle\n'), (self.path, 5, 'alice smith')])
+		self.assertEqual(results[2:], [(other_path, line_no, 'alice\n') for line_no in range(2, 7)])
+		self.assertEqual(list(utilities.grep_files('alice', paths, max_count=1)), [(self.path, 1, 'alice liddle\n'), (other_path, 2, 'alice\n')])
+		self.assertEqual(list(utilities.grep_files('alice', [other_path], invert=True)), [(other_path, 1, 'bob\n')])
+		results = [(os.path.abspath(path), line_no, line) for path, line_no, line in utilities.grep_files('alice', tmp_directory, ordered=False)]
+		self.assertEqual(sorted(results), sorted(utilities.grep_files('alice', paths)))
+
+	def test_grep_iter(self):
+		for memory_map in (True, False):
+			results = list(utilities.grep_iter('smith', self.path, memory_map=memory_map))
+			self.assertEqual(results, [(4, 18, 'charlie smith\n', False), (5, 32, 'alice smith', False)])
+			self.assertEqual(results[0].line_no, 4)
+			self.assertEqual(results[0].offset, 18)
+			results = list(utilities.grep_iter('^bob', self.path, before=2, after=1, memory_map=memory_map))
+			self.assertEqual(results, [(1, 0, 'alice liddle\n', True), (2, 13, 'bob\n', False), (3, 17, '\n', True)])
+			results = list(utilities.grep_iter('alice', self.path, max_count=1, after=1, memory_map=memory_map))
+			self.assertEqual(results, [(1, 0, 'alice liddle\n', False), (2, 13, 'bob\n', True)])
+			results = list(utilities.grep_iter('e', self.path, invert=True, memory_map=memory_map))
+			self.assertEqual(results, [(2, 13, 'bob\n', False), (3, 17, '\n', False)])
+		with open(self.path, 'rb') as file_h:
+			results = utilities.grep_iter('liddle', file_h)
+			self.assertEqual(next(results), (1, 0, 'alice liddle\n', False))
+			self.assertFalse(file_h.closed)
+		self.assertEqual(list(utilities.grep_iter('alice', self.empty_path)), [])
+
+class UtilitiesHybridGeneratorTests(utilities.TestCase):
+	def setUp(self):
+		tmp_directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, tmp_directory)
+		self.wordlist = os.path.join(tmp_directory, 'wordlist.txt')
+		with open(self.wordlist, 'w') as file_h:
+			file_h.write('alice\r\nbob\n\ncalie\n')
+
+	def test_hybrid_generator(self):
+		generator = utilities.HybridGenerator(self.wordlist, '?d?d')
+		candidates = list(generator)
+		self.assertEqual(len(candidates), 300)
+		self.assertEqual(candidates[:2], ['alice00', 'alice01'])
+		self.assertEqual(candidates[-1], 'calie99')
+		self.assertEqual(len(generator), 300)
+		self.assertEqual(generator[150], candidates[150])
+
+		generator = utilities.HybridGenerator(self.wordlist, '?d', prepend=True)
+		self.assertEqual(list(generator)[:2], ['0alice', '1alice'])
+
+	def test_hybrid_generator_shard(self):
+		candidates = list(utilities.HybridGenerator(self.wordlist, '?d?d'))
+		shards = utilities.HybridGenerator(self.wordlist, '?d?d').partition(7)
+		self.assertEqual(list(itertools.chain.from_iterable(shards)), candidates)
+
+	def test_hybrid_generator_state(self):
+		candidates = list(utilities.HybridGenerator(self.wordlist, '?1', charsets={1: 'xyz'}))
+		generator = utilities.HybridGenerator(self.wordlist, '?1', charsets={1: 'xyz'}).shard(1, 2)
+		next(generator)
+		restored = utilities.HybridGenerator.from_state(json.loads(json.dumps(generator.state())))
+		self.assertEqual(list(restored), candidates[len(candidates) // 2 + 1:])
+
+	def test_hybrid_generator_errors(self):
+		with open(self.wordlist, 'ab') as file_h:
+			file_h.write(b'caf\xe9\n')
+		generator = utilities.HybridGenerator(self.wordlist, '?d')
+		with self.assertRaises(UnicodeDecodeError):
+			list(generator)
+		generator.close()
+		generator = utilities.HybridGenerator(self.wordlist, '?d', errors='surrogateescape')
+		candidates = list(generator)
+		self.assertEqual(len(candidates), len(generator))
+		self.assertEqual(candidates[-1].encode('utf-8', 'surrogateescape'), b'caf\xe99')
+		restored = utilities.HybridGenerator.from_state(generator.state())
+		self.assertEqual(restored[len(restored) - 1], candidates[-1])
+		restored.close()
+		generator.close()
+		self.assertEqual(list(generator), [])
+
+class UtilitiesMultiPatternMatcherTests(utilities.TestCase):
+	def test_multi_pattern_matcher(self):
+		matcher = utilities.MultiPatternMatcher(['he', 'she', 'his', 'hers', 'he'])
+		self.assertEqual(len(matcher), 4)
+		self.assertEqual(list(matcher.finditer('ushers')), [(1, 'she'), (2, 'he'), (2, 'hers')])
+		self.assertEqual(matcher.matches('this and ushers'), set(['his', 'she', 'he', 'hers']))
+		self.assertEqual(matcher.search('ushers'), (1, 'she'))
+		self.assertEqual(matcher.search('hersh'), (0, 'hers'))
+		self.assertIsNone(matcher.search('nothing'))
+
+	def test_multi_pattern_matcher_bytes(self):
+		matcher = utilities.MultiPatternMatcher([b'10.0.0.1', b'10.0.0.10', b'a.b'], ignore_case=True)
+		self.assertEqual(list(matcher.finditer(b'from 10.0.0.10 axb A.B')), [(5, b'10.0.0.1'), (5, b'10.0.0.10'), (19, b'a.b')])
+		with self.assertRaises(TypeError):
+			utilities.MultiPatternMatcher(['alice', b'bob'])
+		with self.assertRaises(ValueError):
+			utilities.MultiPatternMatcher([''])
+
+	def test_multi_pattern_matcher_grep(self):
+		tmp_directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, tmp_directory)
+		path = os.path.join(tmp_directory, 'test.log')
+		with open(path, 'w') as file_h:
+			file_h.write('alice liddle\nbob\ncharlie smith\n')
+		matcher = utilities.MultiPatternMatcher(['bob', 'smith', 'eve'])
+		self.assertEqual(utilities.grep(matcher, path), ['bob\n', 'charlie smith\n'])
+		self.assertEqual(utilities.grep(matcher, path, memory_map=True), ['bob\n', 'charlie smith\n'])
+		self.assertEqual([result.line_no for result in utilities.grep_iter(matcher, path)], [2, 3])
+
+class UtilitiesTrigramIndexTests(utilities.TestCase):
+	def setUp(self):
+		self.tmp_directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.tmp_directory)
+		self.corpus = os.path.join(self.tmp_directory, 'corpus')
+		os.mkdir(self.corpus)
+		for index in range(4):
+			with open(os.path.join(self.corpus, "{0}.log".format(index)), 'w') as file_h:
+				for line_no in range(200):
+					file_h.write("line {0} of file {1} status {2}\n".format(line_no, index, ('ok', 'denied', 'kernel panic')[(line_no * (index + 1)) % 3]))
+		with gzip.open(os.path.join(self.corpus, '4.log.gz'), 'wt') as file_h:
+			file_h.write('compressed kernel panic\n')
+		self.index = utilities.TrigramIndex(os.path.join(self.tmp_directory, 'index.db'), block_size=256)
+		self.addCleanup(self.index.close)
+
+	def assertSearchEqual(self, expression, flags=0):
+		expected = sorted((os.path.abspath(path), line_no, line) for path, line_no, line in utilities.grep_files(expression, self.corpus, flags=flags))
+		self.assertEqual(sorted(self.index.search(expression, flags=flags)), expected, msg="search({!r})".format(expression))
+		return expected
+
+	def test_regex_literals(self):
+		self.assertEqual(utilities._regex_literals(r'foo\.bar'), [['foo.bar']])
+		self.assertEqual(utilities._regex_literals('ab?cde'), [['a', 'cde']])
+		self.assertEqual(utilities._regex_literals(r'x[abc]yz(foo|bar)+baz\d'), [['x', 'yz', 'baz']])
+		self.assertEqual(utilities._regex_literals(b'abc{0,2}de'), [[b'ab', b'de']])
+		self.assertIsNone(utilities._regex_literals('foo|bar'))
+		self.assertIsNone(utilities._regex_literals('foo bar', re.VERBOSE))
+
+	def test_trigram_index(self):
+		self.assertEqual(self.index.update(self.corpus), 5)
+		self.assertEqual(self.index.update(self.corpus), 0)
+		self.assertTrue(self.assertSearchEqual('kernel panic'))
+		self.assertTrue(self.assertSearchEqual('KERNEL PANIC$', flags=re.IGNORECASE))
+		self.assertTrue(self.assertSearchEqual(r'line 1\d of file 2'))
+		self.assertTrue(self.assertSearchEqual('denied|ok'))
+		self.assertTrue(self.assertSearchEqual(utilities.MultiPatternMatcher(['compressed', 'line 199 '])))
+		self.assertFalse(self.assertSearchEqual('missing'))
+
+	def test_trigram_index_update(self):
+		self.index.update(self.corpus)
+		path = os.path.join(self.corpus, '0.log')
+		with open(path, 'a') as file_h:
+			file_h.write('appended kernel panic\n')
+		os.remove(os.path.join(self.corpus, '1.log'))
+		# changed files are searched in their entirety until they are indexed again
+		self.assertIn((path, 201, 'appended kernel panic\n'), self.assertSearchEqual('kernel panic'))
+		self.assertEqual(self.index.update(self.corpus), 1)
+		self.assertIn((path, 201, 'appended kernel panic\n'), self.assertSearchEqual('kernel panic'))
+		self.assertEqual(self.index.update([path], prune=True), 0)
+		self.assertEqual([result[0] for result in self.index.search('appended')], [path])
+		self.assertEqual(list(self.index.search('compressed')), [])
+
+	def test_trigram_index_many_files(self):
+		for index in range(5, 1200):
+			with open(os.path.join(self.corpus, "{0}.log".format(index)), 'w') as file_h:
+				file_h.write("file {0} kernel panic\n".format(index))
+		self.index.update(self.corpus)
+		connection = self.index._connect()
+		if hasattr(connection, 'setlimit'):
+			# older versions of SQLite default to this limit
+			connection.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+		self.assertTrue(self.assertSearchEqual('kernel panic'))
+
+	def test_trigram_index_truncated(self):
+		with open(os.path.join(self.corpus, '4.log.gz'), 'rb') as file_h:
+			data = file_h.read()
+		with open(os.path.join(self.corpus, '5.log.gz'), 'wb') as file_h:
+			file_h.write(data[:len(data) // 2])
+		self.assertEqual(self.index.update(self.corpus), 6)
+		self.assertTrue(self.assertSearchEqual('kernel panic'))
+
+	def test_trigram_index_non_ascii(self):
+		with open(os.path.join(self.corpus, '5.log'), 'w', encoding='utf-8') as file_h:
+			file_h.write('module \xe4bcdef loaded\nmodule Abcdef loaded\n')
+		self.index.update(self.corpus)
+		self.assertTrue(self.assertSearchEqual('\xc4BCDEF', flags=re.IGNORECASE))
+		self.assertTrue(self.assertSearchEqual('\xe4bcdef'))
+		self.assertTrue(self.assertSearchEqual('MODULE \xc4', flags=re.IGNORECASE))
+
 class UtilitiesCacheTests(utilities.TestCase):
 	def test_cache(self):
 		target_function = utilities.Cache('6h')(cache_test)
@@ -62,6 +655,43 @@ class UtilitiesCacheTests(utilities.TestCase):
 		target_function.cache_clear()
 		self.assertNotEqual(target_function('alice', 'liddle'), result_alice)
 
+	def test_cache_cache_info(self):
+		target_function = utilities.Cache('6h')(cache_test)
+		target_function('alice', 'liddle')
+		target_function('alice', 'liddle')
+		target_function('calie', 'liddle')
+		cache_info = target_function.cache_info()
+		self.assertEqual(cache_info.hits, 1)
+		self.assertEqual(cache_info.misses, 2)
+		self.assertEqual(cache_info.size, 2)
+		self.assertGreater(cache_info.bytes, 0)
+
+	def test_cache_map(self):
+		target_function = utilities.Cache('6h')(cache_test)
+		result_alice = target_function('alice', 'liddle')
+		results = target_function.map([('alice', 'liddle'), ('calie', 'liddle'), ('alice', 'liddle')])
+		self.assertEqual(len(results), 3)
+		self.assertEqual(results[0], result_alice)
+		self.assertEqual(results[2], result_alice)
+		self.assertEqual(target_function('calie', 'liddle'), results[1])
+
+		batches = []
+		def batch_loader(args_list):
+			batches.append(args_list)
+			return [first_name + ' ' + last_name for first_name, last_name, _, _ in args_list]
+		results = target_function.map([('alice', 'liddle'), ('dinah', 'liddle'), ('edith', 'liddle')], batch_loader=batch_loader)
+		self.assertEqual(results, [result_alice, 'dinah liddle', 'edith liddle'])
+		self.assertEqual(batches, [[('dinah', 'liddle', None, None), ('edith', 'liddle', None, None)]])
+
+	def test_cache_max_bytes(self):
+		target_function = utilities.Cache('6h', max_bytes=1024)(cache_test)
+		for idx in range(20):
+			target_function('alice' + str(idx), 'liddle')
+		cache_info = target_function.cache_info()
+		self.assertGreater(cache_info.evictions, 0)
+		self.assertLessEqual(cache_info.bytes, 1024)
+		self.assertEqual(cache_info.size + cache_info.evictions, 20)
+
 	def test_cache_flatten_args(self):
 		target_function = utilities.Cache('6h')(cache_test)
 		flatten_args = target_function._flatten_args  # pylint: disable=W0212
@@ -95,6 +725,101 @@ class UtilitiesCacheTests(utilities.TestCase):
 		with self.assertRaisesRegex(TypeError, r'^cache_test\(\) got an unexpected keyword argument \'foobar\'$'):
 			flatten_args(('alice', 'liddle'), {'foobar': True})
 
+	def test_cache_sqlite_backend(self):
+		tmp_directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, tmp_directory)
+		backend = utilities.SQLiteCacheBackend(os.path.join(tmp_directory, 'cache.db'))
+		target_function1 = utilities.Cache('6h', backend=backend)(cache_test)
+		target_function2 = utilities.Cache('6h', backend=backend)(cache_test)
+
+		result_alice = target_function1('alice', 'liddle')
+		self.assertEqual(target_function2('alice', 'liddle'), result_alice)
+		self.assertNotEqual(target_function2('calie', 'liddle'), result_alice)
+
+		results = target_function2.map([('alice', 'liddle'), ('dinah', 'liddle')])
+		self.assertEqual(results[0], result_alice)
+		self.assertEqual(target_function1('dinah', 'liddle'), results[1])
+
+		target_function1.cache_clear()
+		self.assertNotEqual(target_function1('alice', 'liddle'), result_alice)
+
+		# equal keys are shared regardless of the identity of their items or the order of set elements
+		host = 'wonderland'
+		result_host = target_function1(host, host)
+		self.assertEqual(target_function2(host, ''.join(('wonder', 'land'))), result_host)
+		result_set = target_function1(frozenset((1, 9)), 'liddle')
+		self.assertEqual(target_function2(frozenset((9, 1)), 'liddle'), result_set)
+
+	def test_cache_persist(self):
+		tmp_directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, tmp_directory)
+		persist_path = os.path.join(tmp_directory, 'cache.pickle')
+		target_function = utilities.Cache('6h', persist=persist_path)(cache_test)
+		result_alice = target_function('alice', 'liddle')
+		target_function.cache_flush()
+
+		target_function = utilities.Cache('6h', persist=persist_path)(cache_test)
+		self.assertEqual(target_function('alice', 'liddle'), result_alice)
+
+		# entries persisted for a different function must be ignored
+		target_function = utilities.Cache('6h', persist=persist_path)(cache_test_alternate)
+		self.assertNotEqual(target_function('alice', 'liddle'), result_alice)
+
+		# files which can not be loaded or have an unexpected layout must be ignored
+		namespace = cache_test.__module__ + '.' + cache_test.__qualname__
+		for data in (b'\x80\xff', pickle.dumps({'version': utilities.CACHE_PERSIST_FORMAT_VERSION, 'namespace': namespace})):
+			with open(persist_path, 'wb') as file_h:
+				file_h.write(data)
+			target_function = utilities.Cache('6h', persist=persist_path)(cache_test)
+			self.assertNotEqual(target_function('alice', 'liddle'), result_alice)
+
+	def test_cache_max_bytes_nested(self):
+		def nested(depth):
+			result = []
+			for _ in range(depth):
+				result = [result]
+			return result
+		target_function = utilities.Cache('6h', max_bytes=1 << 20)(nested)
+		self.assertIsInstance(target_function(5000), list)
+		self.assertGreater(target_function.cache_info().bytes, 0)
+		# modules and functions are shared so they are not included in the size
+		self.assertLess(utilities._estimate_size(utilities.AttributeDict(module=os, function=nested)), 4096)
+
+	def test_cache_stale_ttl(self):
+		target_function = utilities.Cache(0, stale_ttl='1m')(cache_test)
+		result_alice = target_function('alice', 'liddle')
+		# the expired entry is returned while it is refreshed in the background
+		self.assertEqual(target_function('alice', 'liddle'), result_alice)
+		for _ in range(100):
+			if target_function('alice', 'liddle') != result_alice:
+				break
+			time.sleep(0.01)
+		else:
+			self.fail('the stale entry was not refreshed')
+
+	@unittest.skipUnless(hasattr(os, 'fork'), 'os.fork is unavailable')
+	def test_cache_stale_ttl_fork(self):
+		target_function = utilities.Cache(0, stale_ttl='1m')(cache_test)
+		result_alice = target_function('alice', 'liddle')
+		# keep the refresh of the stale entry pending in the parent process while forking
+		event = threading.Event()
+		utilities._CacheRefreshWorker.submit(event.wait)
+		self.addCleanup(event.set)
+		self.assertEqual(target_function('alice', 'liddle'), result_alice)
+		pid = os.fork()
+		if not pid:
+			status = 1
+			try:
+				for _ in range(100):
+					if target_function('alice', 'liddle') != result_alice:
+						status = 0
+						break
+					time.sleep(0.01)
+			finally:
+				os._exit(status)
+		_, status = os.waitpid(pid, 0)
+		self.assertEqual(status, 0, msg='the stale entry was not refreshed in the child process')
+
 class UtilitiesTests(utilities.TestCase):
 	def test_attribute_dict(self):
 		ad = utilities.AttributeDict(test=1)